@@ -0,0 +1,190 @@
+import numpy as np
+
+from pong import window_width, window_height, line_thickness
+
+#Array version of pong.predictEnd(), working out the end points of many
+#ball paths at once. Games whose ball starts off in an unusual spot (on or
+#past a wall) may need a couple of rounds before reaching the regular
+#wall-to-wall legs, every other game is finished in the first round.
+def predictEnd(x, y, dir_x, dir_y):
+    left = line_thickness+2
+    right = window_width-line_thickness-2
+    top = int(line_thickness*1.5)
+    bottom = int(window_height-(line_thickness*1.5))
+    never = np.iinfo(np.int64).max
+
+    x = np.asarray(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    dir_y = np.array(dir_y, dtype=np.int64)
+
+    #Steps until each ball reaches an end column, or 0 if it never does
+    to_left = (left - x)*dir_x
+    to_right = (right - x)*dir_x
+    remaining = np.minimum(np.where(to_left >= 0, to_left, never),
+                           np.where(to_right >= 0, to_right, never))
+    remaining = np.where(remaining == never, 0, remaining)
+    end_x = x + dir_x*remaining
+
+    end_y = np.zeros_like(y)
+    active = np.ones(y.shape, dtype=bool)
+    while active.any():
+        to_top = (top - y)*dir_y
+        to_bottom = (bottom - y)*dir_y
+        to_wall = np.minimum(np.where(to_top >= 0, to_top, never),
+                             np.where(to_bottom >= 0, to_bottom, never))
+        stop = active & (remaining < to_wall)
+        end_y[stop] = (y + dir_y*remaining)[stop]
+        active &= ~stop
+
+        #Bounce one pixel back from the wall, like Path.getEnd()
+        wall = y + dir_y*np.where(active, to_wall, 0)
+        remaining = np.where(active, remaining - to_wall, remaining)
+        y = np.where(active, np.where(wall == top, wall + 1, wall - 1), y)
+        dir_y = np.where(active, -dir_y, dir_y)
+
+        #Skip over all the equal-length legs with a division
+        regular = active & (((y == top + 1) & (dir_y == 1)) |
+                            ((y == bottom - 1) & (dir_y == -1)))
+        leg = bottom - top - 1
+        bounces = remaining // leg
+        odd = regular & (bounces % 2 == 1)
+        remaining = np.where(regular, remaining - bounces*leg, remaining)
+        y = np.where(odd, top + bottom - y, y)
+        dir_y = np.where(odd, -dir_y, dir_y)
+        end_y[regular] = (y + dir_y*remaining)[regular]
+        active &= ~regular
+
+    end_y = np.where(dir_y == -1, end_y + 40, end_y - 40)
+    return end_x, end_y
+
+class BatchGame():
+    #Simulates n games of pong in lockstep. Every piece of state is held in
+    #arrays with one entry per game, and each step follows the same rules
+    #as Game.step() so a single game here plays out exactly like a Game.
+
+    def __init__(self, n, line_thickness=line_thickness, speed=1):
+        self.n = n
+        self.line_thickness = line_thickness
+        self.speed = speed
+
+        #Sizes and starting positions match the ones used by Game
+        self.ball_size = self.line_thickness
+        self.paddle_width = self.line_thickness
+        self.paddle_height = 100
+        self.user_x = window_width - self.paddle_width - 40
+        self.computer_x = 40
+        self.ball_start_x = int(window_width/2 - self.line_thickness/2)
+        self.ball_start_y = int(window_height/2 - self.line_thickness/2)
+        self.paddle_start_y = int(window_height/2 - self.paddle_height/2)
+
+        self.ball_x = np.zeros(n, dtype=np.int64)
+        self.ball_y = np.zeros(n, dtype=np.int64)
+        self.dir_x = np.zeros(n, dtype=np.int64)
+        self.dir_y = np.zeros(n, dtype=np.int64)
+        self.user_y = np.zeros(n, dtype=np.int64)
+        self.computer_y = np.zeros(n, dtype=np.int64)
+        self.hits = np.zeros(n, dtype=np.int64)
+        self.wins = np.zeros(n, dtype=np.int64)
+        self.losses = np.zeros(n, dtype=np.int64)
+
+        self.reset()
+
+    #Puts the given games (all of them by default) back to the start
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        self.ball_x[mask] = self.ball_start_x
+        self.ball_y[mask] = self.ball_start_y
+        self.dir_x[mask] = -1
+        self.dir_y[mask] = -1
+        self.user_y[mask] = self.paddle_start_y
+        self.computer_y[mask] = self.paddle_start_y
+        self.hits[mask] = 0
+        self.wins[mask] = 0
+        self.losses[mask] = 0
+
+    #Games that have been played to the end (same rule as controlled_run)
+    def done(self):
+        return (self.wins >= 7) | (self.losses >= 7)
+
+    def ballCenter(self):
+        half = self.ball_size // 2
+        return self.ball_x + half, self.ball_y + half
+
+    def userCenter(self):
+        return self.user_y + self.paddle_height // 2
+
+    #End points of every ball's path, as Ball.getEnd() gives for one game
+    def getEnd(self):
+        centerx, centery = self.ballCenter()
+        return predictEnd(centerx, centery, self.dir_x, self.dir_y)
+
+    #Moves the user paddles. 1 = up, 0 = down, anything else stays still
+    def move(self, actions):
+        actions = np.asarray(actions)
+        self.user_y += np.where(actions == 1, -self.speed,
+                                np.where(actions == 0, self.speed, 0))
+
+    #Advances every game by one frame. If actions are given the user paddles
+    #are moved first, the same way controlled_run does before Game.update()
+    def step(self, actions=None):
+        if actions is not None:
+            self.move(actions)
+
+        w = self.ball_size
+        s = self.speed
+
+        #Ball.move
+        self.ball_x += self.dir_x * s
+        self.ball_y += self.dir_y * s
+
+        ceiling = (self.dir_y == -1) & (self.ball_y <= w)
+        floor = (self.dir_y == 1) & (self.ball_y + w >= window_height - w)
+        self.dir_y[ceiling | floor] *= -1
+
+        wall = (((self.dir_x == -1) & (self.ball_x <= w)) |
+                ((self.dir_x == 1) & (self.ball_x + w >= window_width - w)))
+        self.dir_x[wall] *= -1
+
+        #AutoPaddle.move
+        ball_centery = self.ball_y + w // 2
+        tracking = self.dir_x == -1
+        computer_centery = self.computer_y + self.paddle_height // 2
+        self.computer_y += np.where(tracking,
+                                    np.where(computer_centery < ball_centery, s, -s),
+                                    0)
+
+        #Collisions and scoring, checked in the same order as Game.step()
+        hit_computer = self.collides(self.computer_x, self.computer_y)
+        hit_user = ~hit_computer & self.collides(self.user_x, self.user_y)
+        rest = ~(hit_computer | hit_user)
+        pass_computer = rest & (self.ball_x + w >= window_width - w)
+        pass_player = rest & ~pass_computer & (self.ball_x <= w)
+
+        self.dir_x[hit_computer | hit_user] *= -1
+        self.hits += hit_user
+        self.losses += pass_computer
+        self.wins += pass_player
+
+        scored = pass_computer | pass_player
+        self.ball_x[scored] = int(window_width/2)
+        self.ball_y[scored] = int(window_height/2)
+
+        self.user_y = self.clamp(self.user_y)
+        self.computer_y = self.clamp(self.computer_y)
+
+        return hit_user, pass_computer, pass_player
+
+    #Same test as pygame.sprite.collide_rect between the balls and paddles
+    def collides(self, paddle_x, paddle_y):
+        w = self.ball_size
+        return ((self.ball_x < paddle_x + self.paddle_width) &
+                (paddle_x < self.ball_x + w) &
+                (self.ball_y < paddle_y + self.paddle_height) &
+                (paddle_y < self.ball_y + w))
+
+    #Keeps the paddles inside the arena, like Paddle.clamp()
+    def clamp(self, paddle_y):
+        low = window_height - self.paddle_width - self.paddle_height
+        return np.where(paddle_y > low, low,
+                        np.where(paddle_y < self.paddle_width, self.paddle_width, paddle_y))
@@ -0,0 +1,209 @@
+import argparse, json, os, platform, random, time
+
+#Drawn games go to a window that is never shown unless a video driver is set
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+
+import pong
+from batch import BatchGame, predictEnd
+
+#Settings for the benchmark games only, the saved settings are left alone
+pong.overrides.update({'speed': 1, 'lines': False, 'show_stats': False,
+                       'render_fps': 0, 'action_repeat': 1, 'user_controlled': False})
+
+#Runs fn over and over for at least min_time seconds, returns calls per second
+def rate(fn, min_time):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+#Moves the user paddle at random, changing direction every few frames
+class RandomPaddle():
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.action = 0
+        self.frames = 0
+
+    def move(self, game):
+        if self.frames % 7 == 0:
+            self.action = self.random.randint(0, 2)
+        self.frames += 1
+        if self.action == 1:
+            game.paddles['user'].move(-1*game.speed)
+        elif self.action == 0:
+            game.paddles['user'].move(game.speed)
+
+    #Wrapper interface used by RunGame.controlled_run
+    def control(self, values):
+        return self.random.randint(0, 1)
+
+    def gameover(self, score):
+        pass
+
+def benchPhysics(headless, min_time):
+    pong.headless = headless
+    game = pong.Game(speed=1)
+    paddle = RandomPaddle()
+
+    def frame():
+        paddle.move(game)
+        if headless:
+            game.step()
+        else:
+            game.update()
+            pong.pygame.display.update(game.dirty_rects)
+
+    return rate(frame, min_time)
+
+#Frames played per second by Game.advance() with a new action every
+#action_repeat frames
+def benchAdvance(action_repeat, min_time):
+    pong.headless = True
+    game = pong.Game(speed=1)
+    rng = random.Random(0)
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        move = rng.choice((-1, 0, 1)) * game.speed
+        frames += game.advance(action_repeat, move)
+        if game.wins >= 7 or game.losses >= 7:
+            game.reset()
+    return frames / (time.perf_counter() - start)
+
+def benchBatch(games, min_time):
+    batch = BatchGame(games)
+    actions = np.random.RandomState(0).randint(0, 2, games)
+    return rate(lambda: batch.step(actions), min_time) * games
+
+#Ball states spread over the arena, to predict the paths of
+def ballStates(n):
+    rng = random.Random(0)
+    return [(rng.randint(40, 960), rng.randint(40, 660), rng.choice((-1, 1)), rng.choice((-1, 1)))
+            for i in range(n)]
+
+def benchPaths(min_time):
+    states = ballStates(100)
+    results = {}
+
+    def paths():
+        for state in states:
+            pong.Path(*state)
+    results['path_get_end_per_s'] = rate(paths, min_time) * len(states)
+
+    chains = [pong.Path(*state) for state in states]
+    def absoluteEnds():
+        for path in chains:
+            path.getAbsoluteEnd()
+    results['path_get_absolute_end_per_s'] = rate(absoluteEnds, min_time) * len(states)
+
+    def predictions():
+        for state in states:
+            pong.predictEnd(*state)
+    results['predict_end_per_s'] = rate(predictions, min_time) * len(states)
+
+    x, y, dir_x, dir_y = [np.array(column) for column in zip(*ballStates(10000))]
+    results['batch_predict_end_per_s'] = rate(lambda: predictEnd(x, y, dir_x, dir_y), min_time) * len(x)
+    return results
+
+def benchEpisodes(episodes):
+    runner = pong.RunGame()
+    wrapper = RandomPaddle()
+    start = time.perf_counter()
+    for i in range(episodes):
+        runner.controlled_run(wrapper, i, True)
+    return episodes / (time.perf_counter() - start)
+
+#Needs keras, so these are skipped when it is not installed
+def benchNetwork(episodes, min_time):
+    try:
+        import network
+    except ImportError as e:
+        return {'network_skipped': str(e)}
+
+    results = {}
+    wrapper = network.Wrapper(start=False)
+    values = {'last_action': None, 'paddle_position': 350, 'ball_end_y': 200}
+    network.num_games = 5
+    calls = rate(lambda: wrapper.control(values), min_time)
+    results['control_latency_us'] = 1e6 / calls
+
+    network.headless = True
+    network.total_games = episodes
+    network.num_games = 0
+    start = time.perf_counter()
+    wrapper.run()
+    results['training_episodes_per_s'] = episodes / (time.perf_counter() - start)
+    return results
+
+def run(args):
+    results = {}
+    print('physics')
+    results['headless_steps_per_s'] = benchPhysics(True, args.min_time)
+    results['rendered_steps_per_s'] = benchPhysics(False, args.min_time)
+    results['batch_game_steps_per_s'] = benchBatch(args.batch_games, args.min_time)
+    results['advance_repeat_8_frames_per_s'] = benchAdvance(8, args.min_time)
+    print('trajectory prediction')
+    results.update(benchPaths(args.min_time))
+    print('episodes')
+    results['headless_episodes_per_s'] = benchEpisodes(args.episodes)
+    if not args.no_network:
+        print('network')
+        results.update(benchNetwork(args.training_episodes, args.min_time))
+    return results
+
+#Compares with the last saved run, anything that got more than 10% worse
+#is marked as a regression
+def compare(results, previous):
+    for name in sorted(results):
+        new = results[name]
+        old = previous.get(name)
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or old == 0:
+            print('%-32s %s' % (name, new))
+            continue
+        change = new / old - 1
+        #Latencies are better when they go down
+        if name.endswith('_us'):
+            change = -change
+        mark = '  REGRESSION' if change < -0.1 else ''
+        print('%-32s %14.2f  (%+.1f%%)%s' % (name, new, change*100, mark))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures how fast the game, the path '
+                                     'prediction and the training loop run.')
+    parser.add_argument('--output', default='benchmarks.json',
+                        help='file the results are added to (default: benchmarks.json)')
+    parser.add_argument('--min-time', type=float, default=2.0,
+                        help='seconds each measurement runs for')
+    parser.add_argument('--episodes', type=int, default=5,
+                        help='headless episodes to time')
+    parser.add_argument('--training-episodes', type=int, default=3,
+                        help='network.py training episodes to time')
+    parser.add_argument('--batch-games', type=int, default=1000,
+                        help='games in the BatchGame benchmark')
+    parser.add_argument('--no-network', action='store_true',
+                        help='skip the benchmarks that need keras')
+    args = parser.parse_args()
+
+    results = run(args)
+
+    runs = []
+    if os.path.exists(args.output):
+        f = open(args.output, 'r')
+        runs = json.load(f)
+        f.close()
+    compare(results, runs[-1]['results'] if len(runs) > 0 else {})
+
+    runs.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'python': platform.python_version(),
+                 'machine': platform.machine(),
+                 'args': vars(args),
+                 'results': results})
+    f = open(args.output, 'w')
+    json.dump(runs, f, indent=2)
+    f.close()
@@ -0,0 +1,148 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from batch import BatchGame
+from pong import window_height
+from memory import closerSamples
+
+class SampleBuffer():
+    #Block of shared memory the collecting processes write their
+    #(distance, action) samples into. Every worker owns its own rows, so no
+    #locking is needed, and the trainer reads the samples straight out of
+    #the shared memory instead of having them pickled over.
+
+    def __init__(self, workers, capacity, name=None):
+        self.workers = workers
+        self.capacity = capacity
+        size = (workers*8 +                 #samples written by each worker
+                workers*capacity*4 +        #distances
+                workers*capacity)           #actions
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.memory.name
+
+        buf = self.memory.buf
+        offset = 0
+        self.counts = np.ndarray((workers,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += workers*8
+        self.distances = np.ndarray((workers, capacity), dtype=np.float32,
+                                    buffer=buf, offset=offset)
+        offset += workers*capacity*4
+        self.actions = np.ndarray((workers, capacity), dtype=np.int8,
+                                  buffer=buf, offset=offset)
+        if self.owner:
+            self.counts[:] = 0
+
+    #Adds samples to a worker's rows, dropping whatever does not fit
+    def add(self, worker, distances, actions):
+        start = int(self.counts[worker])
+        n = min(len(distances), self.capacity - start)
+        if n > 0:
+            self.distances[worker, start:start+n] = distances[:n]
+            self.actions[worker, start:start+n] = actions[:n]
+            #Only counted once the data is in place
+            self.counts[worker] = start + n
+
+    def full(self, worker):
+        return self.counts[worker] >= self.capacity
+
+    #Views of one worker's samples, without copying
+    def view(self, worker):
+        n = int(self.counts[worker])
+        return self.distances[worker, :n], self.actions[worker, :n]
+
+    #Every sample collected so far, gathered into one pair of arrays
+    def samples(self):
+        views = [self.view(worker) for worker in range(self.workers)]
+        x = np.concatenate([distances for distances, actions in views])
+        y = np.concatenate([actions for distances, actions in views])
+        return x, y
+
+    def close(self):
+        #Drop the views before the memory they point into goes away
+        self.counts = self.distances = self.actions = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+#Frames a worker's quota of samples is spread over at the least, so it is
+#not filled by the first few frames of its games
+MIN_FRAMES = 256
+
+#Starts the given games from a random serve height and direction, as
+#evaluate.playMatch() does, with the user paddle at a random height
+def randomServe(game, mask, random):
+    n = int(np.count_nonzero(mask))
+    w = game.ball_size
+    s = game.speed
+    game.ball_y[mask] = random.randint(w + s + 1, window_height - 2*w - s, n)
+    game.dir_y[mask] = random.choice((-1, 1), n)
+    game.user_y[mask] = random.randint(game.paddle_width,
+                                       window_height - game.paddle_width - game.paddle_height + 1, n)
+
+#Run in each worker process. Plays games against the AutoPaddle with random
+#moves and keeps the moves that brought the paddle closer to where the ball
+#is going to end up, the same samples Wrapper.control() collects. At most
+#capacity/MIN_FRAMES samples, picked at random, are kept from each frame.
+def collectWorker(name, workers, capacity, worker, games, seed, speed):
+    buffer = SampleBuffer(workers, capacity, name=name)
+    random = np.random.RandomState(seed + worker)
+    per_frame = max(1, -(-capacity // MIN_FRAMES))
+
+    game = BatchGame(games, speed=speed)
+    randomServe(game, np.ones(games, dtype=bool), random)
+    last_action = np.full(games, -1)
+    last_distance = None
+
+    while not buffer.full(worker):
+        end_x, end_y = game.getEnd()
+        distance = game.userCenter() - end_y
+
+        if last_distance is not None:
+            keep = np.flatnonzero(closerSamples(last_distance, distance, last_action))
+            if len(keep) > per_frame:
+                keep = random.choice(keep, per_frame, replace=False)
+            buffer.add(worker, distance[keep], last_action[keep])
+        last_distance = distance
+
+        action = random.randint(0, 2, games)
+        game.step(action)
+        last_action = action
+
+        finished = game.done()
+        if finished.any():
+            game.reset(finished)
+            randomServe(game, finished, random)
+            last_action[finished] = -1
+
+    buffer.close()
+
+#Collects samples with the given number of worker processes, each playing
+#games_per_worker games at once until it has written samples_per_worker
+#samples, at the given game speed. The returned buffer must be closed once
+#the samples are used.
+def collect(workers, samples_per_worker, games_per_worker=64, seed=0, speed=1):
+    buffer = SampleBuffer(workers, samples_per_worker)
+    processes = []
+    for worker in range(workers):
+        process = multiprocessing.Process(target=collectWorker,
+                                          args=(buffer.name, workers, samples_per_worker,
+                                                worker, games_per_worker, seed, speed))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+    #Samples of a single action would teach the model nothing
+    actions = [buffer.view(worker)[1] for worker in range(workers)]
+    total = sum(len(a) for a in actions)
+    up = sum(int(np.count_nonzero(a == 1)) for a in actions)
+    if total > 1 and (up == 0 or up == total):
+        print("Warning: the collected samples are all of one action")
+    return buffer
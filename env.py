@@ -0,0 +1,76 @@
+import numpy as np
+
+import pong
+
+#gym is only needed to describe the spaces to RL libraries that ask for them
+try:
+    import gym
+    from gym import spaces
+except ImportError:
+    gym = None
+
+#Actions, the same numbers controlled_run uses for the user paddle
+DOWN = 0
+UP = 1
+STAY = 2
+
+class PongEnv():
+    #Headless game with a reset()/step() interface, so the trainer runs the
+    #loop instead of controlled_run calling back into a wrapper. The
+    #observation is one array that is filled in place on every call:
+    #
+    #  0 user paddle centre y    3 end x of the ball's path
+    #  1 ball centre x           4 end y of the ball's path
+    #  2 ball centre y           5 score (hits + times scored - times scored on)
+    #
+    #The same array is returned each time, so copy it to keep it around.
+    #The reward is the change in score.
+
+    def __init__(self, speed=1, action_repeat=1, max_frames=None):
+        pong.headless = True
+        self.game = pong.Game(speed=speed)
+        self.game.settings.updateSpeed(speed)
+        self.action_repeat = action_repeat
+        self.max_frames = max_frames
+        self.frames = 0
+        self.observation = np.zeros(6, dtype=np.float32)
+        self.info = {}
+        if gym is not None:
+            self.action_space = spaces.Discrete(3)
+            self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(6,),
+                                                dtype=np.float32)
+
+    def score(self):
+        return self.game.hits + self.game.wins - self.game.losses
+
+    def observe(self):
+        return self.game.observe(self.observation)
+
+    def done(self):
+        if self.max_frames is not None and self.frames >= self.max_frames:
+            return True
+        return self.game.wins >= 7 or self.game.losses >= 7
+
+    def reset(self):
+        self.game.reset()
+        self.frames = 0
+        return self.observe()
+
+    #Plays the action for action_repeat frames (fewer if the game ends)
+    def step(self, action):
+        game = self.game
+        score = self.score()
+        move = 0
+        if action == UP:
+            move = -1*game.speed
+        elif action == DOWN:
+            move = game.speed
+        frames = self.action_repeat
+        if self.max_frames is not None:
+            frames = min(frames, self.max_frames - self.frames)
+        #advance() stops after every point, which is when the game can end
+        while frames > 0 and not self.done():
+            played = game.advance(frames, move)
+            self.frames += played
+            frames -= played
+        return self.observe(), self.score() - score, self.done(), self.info
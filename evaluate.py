@@ -0,0 +1,153 @@
+import argparse, json, multiprocessing, random, time
+
+import numpy as np
+
+import pong
+from policy import DensePolicy
+
+#Set in each worker process by startWorker()
+worker_policy = None
+
+def startWorker(layers):
+    global worker_policy
+    pong.headless = True
+    if layers is not None:
+        worker_policy = DensePolicy(layers)
+
+#Action for a paddle to end point distance: the policy's if there is one,
+#otherwise the paddle just heads for the end point
+def choose(distance):
+    if worker_policy is not None:
+        return worker_policy.action(float(distance))
+    return 1 if distance > 0 else 0
+
+#Plays one match against the AutoPaddle. The seed picks the height and
+#direction of the first serve, and the noise moves made at random. The
+#match is called off after max_frames frames.
+def playMatch(job):
+    seed, speed, action_repeat, noise, max_frames = job
+    rng = random.Random(seed)
+    game = pong.Game(speed=speed)
+    game.settings.updateSpeed(speed)
+    game.ball.rect.y = rng.randint(game.ball.w + speed + 1,
+                                   pong.window_height - 2*game.ball.w - speed - 1)
+    game.ball.dir_y = rng.choice((-1, 1))
+
+    frames = 0
+    rally_frames = 0
+    rally_hits = 0
+    rallies = []
+    points = game.wins + game.losses
+    hits = game.hits
+    while game.wins < 7 and game.losses < 7 and frames < max_frames:
+        end_x, end_y = game.ball.getEnd()
+        distance = game.paddles['user'].rect.centery - end_y
+        if noise > 0 and rng.random() < noise:
+            action = rng.randint(0, 1)
+        else:
+            action = choose(distance)
+        move = -1*game.speed if action == 1 else game.speed
+
+        played = game.advance(min(action_repeat, max_frames - frames), move)
+        frames += played
+        rally_frames += played
+        if game.wins + game.losses != points:
+            rally_hits += game.hits - hits
+            rallies.append((rally_frames, rally_hits))
+            points = game.wins + game.losses
+            hits = game.hits
+            rally_frames = 0
+            rally_hits = 0
+
+    return {'seed': seed, 'hits': game.hits, 'wins': game.wins, 'losses': game.losses,
+            'frames': frames, 'finished': game.wins >= 7 or game.losses >= 7,
+            'rallies': rallies}
+
+#Plays the matches with a pool of worker processes and adds their results up
+def evaluate(layers, matches, workers, speed=1, action_repeat=1, noise=0.0,
+             max_frames=1000000, seed=0):
+    jobs = [(seed + i, speed, action_repeat, noise, max_frames) for i in range(matches)]
+    start = time.perf_counter()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=startWorker, initargs=(layers,))
+        results = list(pool.imap_unordered(playMatch, jobs))
+        pool.close()
+        pool.join()
+    else:
+        startWorker(layers)
+        results = [playMatch(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+    return summarize(results, elapsed)
+
+def summarize(results, elapsed):
+    hits = sum(r['hits'] for r in results)
+    losses = sum(r['losses'] for r in results)
+    frames = sum(r['frames'] for r in results)
+    rally_frames = np.array([f for r in results for f, h in r['rallies']], dtype=float)
+    rally_hits = np.array([h for r in results for f, h in r['rallies']], dtype=float)
+    finished = [r for r in results if r['finished']]
+
+    summary = {'matches': len(results),
+               'finished': len(finished),
+               'win_rate': (sum(1 for r in finished if r['wins'] >= 7) / len(finished)
+                            if len(finished) > 0 else None),
+               'points_won': sum(r['wins'] for r in results),
+               'points_lost': losses,
+               'hits': hits,
+               'hits_per_lost_point': hits / losses if losses > 0 else None,
+               'rallies': len(rally_frames),
+               'seconds': elapsed,
+               'matches_per_s': len(results) / elapsed,
+               'frames_per_s': frames / elapsed}
+    if len(rally_frames) > 0:
+        for name, values in (('rally_frames', rally_frames), ('rally_hits', rally_hits)):
+            summary[name] = {'mean': float(values.mean()),
+                             'min': float(values.min()),
+                             'p10': float(np.percentile(values, 10)),
+                             'median': float(np.median(values)),
+                             'p90': float(np.percentile(values, 90)),
+                             'max': float(values.max())}
+    return summary
+
+def report(summary):
+    for name, value in summary.items():
+        if isinstance(value, dict):
+            print('%-20s %s' % (name, '  '.join('%s %.1f' % item for item in value.items())))
+        elif isinstance(value, float):
+            print('%-20s %.3f' % (name, value))
+        else:
+            print('%-20s %s' % (name, value))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plays a policy against the computer paddle '
+                                     'and reports how well it does.')
+    parser.add_argument('weights', nargs='?',
+                        help='.npz file saved by DensePolicy.saveWeights (network.policy_path), '
+                        'without one the paddle heads straight for the end point')
+    parser.add_argument('--matches', type=int, default=100, help='matches to play')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='processes to play them with')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first match')
+    parser.add_argument('--speed', type=int, default=1)
+    parser.add_argument('--action-repeat', type=int, default=1,
+                        help='frames each action is kept for')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='chance of a random move instead of the policy\'s')
+    parser.add_argument('--max-frames', type=int, default=1000000,
+                        help='frames after which a match is called off')
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    layers = None
+    if args.weights is not None:
+        policy = DensePolicy()
+        policy.loadWeights(args.weights)
+        layers = policy.getWeights()
+
+    summary = evaluate(layers, args.matches, args.workers, args.speed, args.action_repeat,
+                       args.noise, args.max_frames, args.seed)
+    report(summary)
+    if args.json is not None:
+        f = open(args.json, 'w')
+        json.dump(summary, f, indent=2)
+        f.close()
@@ -0,0 +1,84 @@
+import numpy as np
+
+#Which samples of a frame to keep: the actions that brought the paddle
+#closer to where the ball will end up. last_distance and distance are the
+#paddle to end point distances before and after the actions (numbers or
+#arrays), and an action of -1 (none taken yet) is never kept.
+def closerSamples(last_distance, distance, last_action):
+    return (np.abs(last_distance) > np.abs(distance)) & (np.asarray(last_action) != -1)
+
+class ReplayMemory():
+    #Fixed size store of (distance, action) training samples. The arrays are
+    #allocated once and used as a ring: adding a sample is O(1) and once the
+    #memory is full the oldest samples are written over. Actions are kept
+    #one-hot encoded as they come in, so they can go straight into fit().
+
+    def __init__(self, capacity, actions=2):
+        self.capacity = capacity
+        self.x = np.zeros((capacity, 1), dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.int8)
+        self.y_cat = np.zeros((capacity, actions), dtype=np.float32)
+        self.next = 0
+        self.size = 0
+        #Samples added since the memory was made, to tell which ones are new
+        #since some point
+        self.added = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, x, y):
+        i = self.next
+        self.x[i, 0] = x
+        self.y[i] = y
+        self.y_cat[i] = 0
+        self.y_cat[i, int(y)] = 1
+        self.next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+
+    #Adds many samples at once
+    def extend(self, xs, ys):
+        xs = np.asarray(xs)[-self.capacity:]
+        ys = np.asarray(ys, dtype=np.int64)[-self.capacity:]
+        n = len(xs)
+        if n == 0:
+            return
+        index = (self.next + np.arange(n)) % self.capacity
+        self.x[index, 0] = xs
+        self.y[index] = ys
+        self.y_cat[index] = 0
+        self.y_cat[index, ys] = 1
+        self.next = (self.next + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self.added += n
+
+    #Views of every stored sample (not in the order they were added)
+    def data(self):
+        return self.x[:self.size], self.y_cat[:self.size]
+
+    #A random minibatch of stored samples
+    def sample(self, batch_size):
+        index = np.random.randint(0, self.size, batch_size)
+        return self.x[index], self.y_cat[index]
+
+    #The last n samples added, oldest first
+    def recent(self, n):
+        n = min(n, self.size)
+        index = (self.next - n + np.arange(n)) % self.capacity
+        return self.x[index], self.y_cat[index]
+
+    #Arrays holding everything in the memory, for saving it with np.savez
+    def getState(self):
+        return {'x': self.x[:, 0], 'y': self.y, 'y_cat': self.y_cat,
+                'position': np.array([self.next, self.size, self.added])}
+
+    #Puts back a state from getState(). The capacity has to be the same.
+    def setState(self, state):
+        if len(state['x']) != self.capacity:
+            raise ValueError('saved memory holds %d samples, this one %d'
+                             % (len(state['x']), self.capacity))
+        self.x[:, 0] = state['x']
+        self.y[:] = state['y']
+        self.y_cat[:] = state['y_cat']
+        self.next, self.size, self.added = [int(value) for value in state['position']]
@@ -1,92 +1,551 @@
 from keras.models import Sequential
 from keras.layers import Dense
 from keras.optimizers import Adam
-from keras.utils.np_utils import to_categorical
 
-from pong import RunGame
-import sys
+from pong import RunGame, overrides, readOverrides, currentSetting
+from batch import BatchGame
+from collect import collect
+from memory import ReplayMemory, closerSamples
+from recording import TrajectoryWriter, Trajectories
+from policy import DensePolicy
+from server import startServers, GameClient
+import sys, os, shutil, tempfile, threading
 import numpy as np
 
-from random import randint
-
 total_games = 10000
 num_games = 0
 
-x_train = np.array([])
-y_train = np.array([])
+#Training samples, the oldest are dropped once memory_size is reached
+memory_size = 1000
+memory = ReplayMemory(memory_size)
 
 train_frequency = 1
 
-model = Sequential()
-model.add(Dense(1, input_dim=1, activation='sigmoid'))
-model.add(Dense(2, activation='softmax'))
-model.compile(Adam(lr=0.1), loss='categorical_crossentropy', metrics=['accuracy'])
+learning_rate = 0.1
+
+#Epochs of each full refit of memory
+epochs = 50
+
+#Samples are only collected during the first bootstrap_games games
+bootstrap_games = 5
+
+#Runs the games without a window, physics only
+headless = False
+
+#Number of headless games played at once, sharing one model call per frame
+batch_games = 1
+
+#Both paddles are played by the model, which gives twice the samples per
+#frame. Only used when the games are played one after another by run().
+self_play = False
+
+#Processes that play the games for this one over Unix sockets, with
+#server_games games each (see server.py), 0 to play them in this process
+servers = 0
+server_games = 64
+
+#Worker processes that collect the first training samples in parallel
+#before any game is played, 0 to collect them during the first games only
+collect_workers = 0
+collect_samples = 1000
+
+#Directory the games played by run() are recorded to, None to not record
+#them. Recordings can be trained on later with train_offline().
+record_path = None
+
+#File the trained policy is saved to once all games are played, for
+#evaluate.py. None to not save it.
+policy_path = None
+
+#File the model, its optimizer, memory and the number of games played are
+#saved to every checkpoint_every games and at the end. With resume they
+#are loaded from it when training starts, to carry on where it stopped.
+checkpoint_path = None
+checkpoint_every = 50
+resume = False
+
+#File the samples of the bootstrap games (or of collect_workers) are saved
+#to. When it already exists they are loaded from it instead, and no games
+#are spent collecting them.
+bootstrap_cache = None
+
+#Trains the model in a thread next to the games instead of stopping every
+#game for it, the new weights are picked up between frames
+background_training = False
+
+#Instead of refitting on all of memory for 50 epochs after a game, make
+#updates_per_episode minibatch updates of batch_size samples. Half of each
+#minibatch is samples added since the last training while there are any,
+#the rest is picked at random from memory.
+incremental_training = False
+updates_per_episode = 20
+batch_size = 32
+
+def buildModel():
+    model = Sequential()
+    model.add(Dense(1, input_dim=1, activation='sigmoid'))
+    model.add(Dense(2, activation='softmax'))
+    model.compile(Adam(lr=learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+model = buildModel()
+
+#Copy of the model's weights the actions are picked with, loaded again
+#after every fit
+policy = DensePolicy()
+policy.load(model)
+
+#Held while samples are added to or copied out of memory, which the
+#background trainer reads from its own thread
+memory_lock = threading.Lock()
+
+#Held while the model is trained or saved
+model_lock = threading.Lock()
 
 last_distance = None
 
-class Wrapper(object):
+#memory.added when the model was last trained
+trained_samples = 0
+
+#Trains the model on memory, the way chosen by incremental_training, and
+#returns a line about it for the progress output
+def train(verbose=1):
+    global trained_samples
+    
+    if not incremental_training:
+        with memory_lock:
+            x_train, y_train_cat = [a.copy() for a in memory.data()]
+        if len(x_train) == 0:
+            return None
+        with model_lock:
+            model.fit(x_train, y_train_cat, epochs = epochs, verbose = verbose, shuffle = 1)
+        return 'fit on %d samples' % len(x_train)
+    
+    half = batch_size//2
+    batches = []
+    with memory_lock:
+        if len(memory) == 0:
+            return None
+        new = min(memory.added - trained_samples, len(memory), updates_per_episode*half)
+        x_new, y_new = memory.recent(new)
+        trained_samples = memory.added
+        for i in range(updates_per_episode):
+            x_part, y_part = x_new[i*half:(i+1)*half], y_new[i*half:(i+1)*half]
+            x_old, y_old = memory.sample(batch_size - len(x_part))
+            batches.append((np.concatenate([x_part, x_old]), np.concatenate([y_part, y_old])))
+    
+    with model_lock:
+        losses = [np.ravel(model.train_on_batch(x_train, y_train_cat))[0]
+                  for x_train, y_train_cat in batches]
+    return '%d updates, %d new samples, loss %.4f' % (len(batches), new, np.mean(losses))
+
+#Speed the games are played at, the one set for the single games played
+#through controlled_run (settings file, PONG_SPEED or --speed=)
+def gameSpeed():
+    return currentSetting('speed', 1)
+
+class BackgroundTrainer(threading.Thread):
+    #Fits the model whenever it is asked to by request(), on a copy of
+    #memory taken at that point, while the games keep going. After each fit
+    #the weights are published with a new version number, and the playing
+    #side swaps them into its policy with swap() when it sees a new one.
+    #Only this thread calls the model, the games act with the policy.
+
     def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.requested = threading.Event()
+        #Set by request() and cleared when the fit starts, so a request made
+        #just before stop() is still fitted
+        self.pending = False
+        self.stopping = False
+        self.weights = None
+        self.version = 0
+        self.fits = 0
+
+    def request(self):
+        self.pending = True
+        self.requested.set()
+
+    def run(self):
+        while True:
+            if not self.pending:
+                if self.stopping:
+                    return
+                self.requested.wait()
+                self.requested.clear()
+                continue
+            self.pending = False
+            if train(verbose = 0) is None:
+                continue
+            published = DensePolicy()
+            published.load(model)
+            #One assignment then the version, so swap() never sees half of it
+            self.weights = published.getWeights()
+            self.version += 1
+            self.fits += 1
+
+    #Loads the last published weights into the policy if they are new
+    def swap(self, version):
+        if self.weights is not None and self.version != version:
+            version = self.version
+            policy.setLayers(self.weights)
+        return version
+
+    #Fits once more if that was asked for, stops the thread and loads the
+    #last weights into the policy. Returns the version now in the policy.
+    def stop(self, version):
+        self.stopping = True
+        self.requested.set()
+        self.join()
+        return self.swap(version)
+
+class Wrapper(object):
+    #With start=False nothing is played until run() or batch_run() is called
+    def __init__(self, start=True):
+        self.trainer = None
+        self.weights_version = 0
+        #Last distances and actions of both paddles in self play
+        self.last_distances = None
+        self.last_actions = None
+        if not start:
+            return
+        if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+            loadCheckpoint(checkpoint_path)
+            print('resumed from %s after %d games' % (checkpoint_path, num_games))
+        elif bootstrap_cache is not None and os.path.exists(bootstrap_cache):
+            warmStart(bootstrap_cache)
+        elif collect_workers > 0:
+            self.bootstrap()
+            if bootstrap_cache is not None:
+                saveSamples(bootstrap_cache)
+        if background_training:
+            self.trainer = BackgroundTrainer()
+            self.trainer.start()
+        if servers > 0:
+            self.remote_run()
+        elif headless and batch_games > 1:
+            self.batch_run()
+        else:
+            self.run()
+        if self.trainer is not None:
+            self.weights_version = self.trainer.stop(self.weights_version)
+            print('%d background fits during %d games' % (self.trainer.fits, num_games))
+        if policy_path is not None:
+            policy.saveWeights(policy_path)
+        if checkpoint_path is not None:
+            saveCheckpoint(checkpoint_path)
+        
+    #Plays the games one after another, each one reusing the last game
+    def run(self):
         game = RunGame()
-        game.controlled_run(self, num_games)
+        recorder = TrajectoryWriter(record_path) if record_path is not None else None
+        while num_games < total_games:
+            game.controlled_run(self, num_games, headless, recorder, self_play)
+        if recorder is not None:
+            recorder.close()
+        
+    #Fills the training data with samples from collect_workers processes
+    #playing against the AutoPaddle at the same time
+    def bootstrap(self):
+        buffer = collect(collect_workers, collect_samples // collect_workers, speed=gameSpeed())
+        x, y = buffer.samples()
+        memory.extend(x, y)
+        buffer.close()
+        
+    #Picks actions for any number of paddle to ball distances with a single
+    #forward pass of the policy
+    def act(self, distances):
+        distances = np.asarray(distances, dtype=float).reshape(-1, 1)
+        prediction = policy.act(distances)
+        
+        r = np.random.randint(0, 4, len(distances))
+        
+        random_rate = 1*(1-(num_games)/1)
+        
+        #Random moves go the opposite way to the prediction
+        return np.where(r <= random_rate, 1 - prediction, prediction)
+        
+    #act() for one distance, without going through arrays
+    def actOne(self, distance):
+        prediction = policy.action(distance)
+        
+        r = np.random.randint(0, 4)
+        
+        random_rate = 1*(1-(num_games)/1)
+        
+        if r <= random_rate:
+            return 1 - prediction
+        return prediction
         
     def control(self, values):
-        global x_train
-        global y_train
         global highest_score
         
         global model
         
         global last_distance
         
-        if num_games < 5:
+        if num_games < bootstrap_games:
             if last_distance == None:
                 last_distance = values['paddle_position'] - values['ball_end_y']
                 
-            if abs(last_distance) > abs(values['paddle_position'] - values['ball_end_y']) and x_train.size < 1000:
-                if values['last_action'] != None:
-                    x_train = np.append(x_train, values['paddle_position'] - values['ball_end_y'])
-                    y_train = np.append(y_train, values['last_action'])
+            distance = values['paddle_position'] - values['ball_end_y']
+            last_action = -1 if values['last_action'] is None else values['last_action']
+            if closerSamples(last_distance, distance, last_action):
+                with memory_lock:
+                    memory.add(distance, last_action)
             
             last_distance = values['paddle_position'] - values['ball_end_y']
         
-        prediction = model.predict_classes(np.array([[values['paddle_position'] - values['ball_end_y']]]))
-
-        r = randint(0, 3)
+        if self.trainer is not None:
+            self.weights_version = self.trainer.swap(self.weights_version)
         
-        random_rate = 1*(1-(num_games)/1)
+        return self.actOne(values['paddle_position'] - values['ball_end_y'])
         
-        if r <= random_rate:
-            if prediction == 0:
-                return 1
-            else:
-                return 0
-        else:
-            if prediction == 1:
-                return 1
-            else:
-                return 0
+    #control() for both paddles in self play. The computer's observation is
+    #mirrored to look like the user's, so both go through act() together.
+    def controlBoth(self, observations):
+        distances = np.array([observation[0] - observation[4] for observation in observations])
+        
+        if num_games < bootstrap_games:
+            if self.last_distances is not None:
+                keep = closerSamples(self.last_distances, distances, self.last_actions)
+                with memory_lock:
+                    memory.extend(distances[keep], self.last_actions[keep])
+            self.last_distances = distances
+        
+        if self.trainer is not None:
+            self.weights_version = self.trainer.swap(self.weights_version)
+        
+        actions = self.act(distances)
+        self.last_actions = actions
+        return [int(action) for action in actions]
+        
+    #Plays batch_games games side by side. Every frame the observations of
+    #all of them go through the model together and the actions are handed
+    #back to each game's user paddle.
+    def batch_run(self):
+        games = BatchGame(batch_games, speed=gameSpeed())
+        last_action = np.full(batch_games, -1)
+        last_distance = None
+        
+        while num_games < total_games:
+            end_x, end_y = games.getEnd()
+            distance = games.userCenter() - end_y
+            
+            #Same sampling as control(), for every game at once
+            if num_games < bootstrap_games:
+                if last_distance is not None:
+                    keep = closerSamples(last_distance, distance, last_action)
+                    with memory_lock:
+                        memory.extend(distance[keep], last_action[keep])
+                last_distance = distance
+            
+            if self.trainer is not None:
+                self.weights_version = self.trainer.swap(self.weights_version)
+            
+            action = self.act(distance)
+            games.step(action)
+            last_action = action
+            
+            finished = games.done()
+            if finished.any():
+                scores = games.hits + games.wins - games.losses
+                #Games finishing together past the total are not counted
+                for score in scores[finished]:
+                    if num_games >= total_games:
+                        break
+                    self.gameover(score)
+                games.reset(finished)
+                last_action[finished] = -1
+                if last_distance is not None:
+                    last_distance[finished] = distance[finished]
         
+    #Same as batch_run() with the games played by server processes. Each
+    #frame one batch of actions goes out and one of observations comes back.
+    def remote_run(self):
+        directory = tempfile.mkdtemp(prefix='pong-')
+        processes, paths = startServers(servers, server_games, gameSpeed(), directory)
+        client = GameClient(paths)
+        observation, reward, done = client.reset()
+        distance = observation[:, 0] - observation[:, 4]
+        score = np.zeros(client.n)
+        
+        while num_games < total_games:
+            action = self.act(distance)
+            observation, reward, done = client.step(action)
+            last_distance = distance
+            distance = observation[:, 0] - observation[:, 4]
+            score += reward
+            
+            #Same sampling as control(), finished games have started again
+            #and are left out
+            if num_games < bootstrap_games:
+                keep = closerSamples(last_distance, distance, np.where(done, -1, action))
+                with memory_lock:
+                    memory.extend(distance[keep], action[keep])
+            
+            if self.trainer is not None:
+                self.weights_version = self.trainer.swap(self.weights_version)
+            
+            if done.any():
+                for final in score[done]:
+                    if num_games >= total_games:
+                        break
+                    self.gameover(int(final))
+                score[done] = 0
+        
+        client.close()
+        for process in processes:
+            process.join()
+        shutil.rmtree(directory, ignore_errors=True)
+        
+    #Counts a finished game and trains the model when it is due
     def gameover(self, score):
         global num_games
-        global x_train
-        global y_train
         global model
         
         num_games += 1
+        self.last_distances = None
+        self.last_actions = None
         
         if num_games % train_frequency == 0:
-            if x_train.size > 0 and y_train.size > 0:
-                y_train_cat = to_categorical(y_train, 2)
-                model.fit(x_train, y_train_cat, epochs = 50, verbose = 1, shuffle = 1)
-                #x_train = np.array([])
-                #y_train = np.array([])
-            
-            
+            if self.trainer is not None:
+                self.trainer.request()
+            else:
+                progress = train(verbose = 0 if incremental_training else 1)
+                if progress is not None:
+                    policy.load(model)
+                    if incremental_training:
+                        print('game %d, score %d: %s' % (num_games, score, progress))
         
-        if num_games >= total_games:
-            sys.exit()
-        game = RunGame()
-        game.controlled_run(self, num_games)
+        if num_games == bootstrap_games and bootstrap_cache is not None:
+            if not os.path.exists(bootstrap_cache):
+                saveSamples(bootstrap_cache)
+        if checkpoint_path is not None and num_games % checkpoint_every == 0:
+            saveCheckpoint(checkpoint_path)
+
+#Writes arrays to an .npz file through a temporary file, so a crash while
+#saving leaves the last complete file in place
+def saveArrays(path, arrays):
+    f = open(path + '.tmp', 'wb')
+    np.savez(f, **arrays)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(path + '.tmp', path)
+
+def saveCheckpoint(path):
+    arrays = {}
+    with model_lock:
+        for i, weights in enumerate(model.get_weights()):
+            arrays['model_%d' % i] = weights
+        for i, weights in enumerate(model.optimizer.get_weights()):
+            arrays['optimizer_%d' % i] = weights
+    with memory_lock:
+        for name, value in memory.getState().items():
+            arrays['memory_' + name] = value
+    arrays['counters'] = np.array([num_games, trained_samples])
+    saveArrays(path, arrays)
+
+#Numbered arrays saved under prefix_0, prefix_1, ...
+def numbered(data, prefix):
+    arrays = []
+    while '%s_%d' % (prefix, len(arrays)) in data.files:
+        arrays.append(data['%s_%d' % (prefix, len(arrays))])
+    return arrays
+
+def loadCheckpoint(path):
+    global num_games, trained_samples
+    
+    data = np.load(path)
+    memory.setState({name: data['memory_' + name] for name in ('x', 'y', 'y_cat', 'position')})
+    optimizer = numbered(data, 'optimizer')
+    if len(optimizer) > 0 and len(model.optimizer.get_weights()) == 0:
+        #The optimizer only makes its weights on the first update, which
+        #the model weights loaded next undo
+        model.train_on_batch(*memory.sample(1))
+    model.set_weights(numbered(data, 'model'))
+    if len(optimizer) > 0:
+        model.optimizer.set_weights(optimizer)
+    num_games, trained_samples = [int(value) for value in data['counters']]
+    data.close()
+    policy.load(model)
+
+#Saves the samples in memory as a bootstrap cache
+def saveSamples(path):
+    with memory_lock:
+        x, y_cat = memory.data()
+        saveArrays(path, {'x': x[:, 0], 'y': y_cat.argmax(axis=1)})
+
+#Fills memory from a bootstrap cache. The samples stand in for the ones
+#the bootstrap games would have collected, so none are collected.
+def warmStart(path):
+    global bootstrap_games
+    
+    data = np.load(path)
+    memory.extend(data['x'], data['y'])
+    data.close()
+    bootstrap_games = 0
+    print('loaded %d bootstrap samples from %s' % (len(memory), path))
+
+#Changes the settings above (given as a dict of their names and values)
+#and starts training again from nothing with them: a new model, empty
+#memory and no games played
+def configure(settings):
+    global memory, model, num_games, last_distance, trained_samples
+    
+    for name, value in settings.items():
+        if name not in CONFIGURABLE:
+            raise KeyError('unknown setting: %s' % name)
+        globals()[name] = value
+    memory = ReplayMemory(memory_size)
+    model = buildModel()
+    policy.load(model)
+    num_games = 0
+    last_distance = None
+    trained_samples = 0
+
+CONFIGURABLE = ('total_games', 'memory_size', 'train_frequency', 'learning_rate', 'epochs',
+                'bootstrap_games', 'headless', 'batch_games', 'self_play', 'servers',
+                'server_games', 'collect_workers', 'collect_samples', 'record_path',
+                'policy_path', 'checkpoint_path', 'checkpoint_every', 'resume',
+                'bootstrap_cache', 'background_training', 'incremental_training',
+                'updates_per_episode', 'batch_size')
+
+#Trains the model on recorded games instead of playing any, taking the same
+#samples control() would have while they were played. passes defaults to
+#epochs.
+def train_offline(paths, passes=None, chunk_size=100000, seed=0):
+    if passes is None:
+        passes = epochs
+    x, y = [], []
+    for path in paths:
+        x_path, y_path = Trajectories(path).samples()
+        x.append(x_path)
+        y.append(y_path)
+    x = np.concatenate(x).reshape(-1, 1)
+    y = np.concatenate(y)
+    if len(x) == 0:
+        return
+    
+    #Every pass goes through the samples of all the recordings in a new
+    #random order, in minibatches of batch_size. Only chunk_size of them
+    #are turned into categories at a time.
+    categories = np.eye(2, dtype=np.float32)
+    random = np.random.RandomState(seed)
+    with model_lock:
+        for i in range(passes):
+            order = random.permutation(len(x))
+            losses = []
+            for start in range(0, len(x), chunk_size):
+                part = order[start:start + chunk_size]
+                history = model.fit(x[part], categories[y[part]], epochs = 1,
+                                    batch_size = batch_size, verbose = 0, shuffle = 0)
+                losses.append(history.history['loss'][-1])
+            print('pass %d/%d, %d samples, loss %.4f' % (i + 1, passes, len(x), np.mean(losses)))
+        policy.load(model)
 
 if __name__ == '__main__':
+    #Settings can be given for this run as --fps=1000, --speed=3, ...
+    overrides.update(readOverrides(sys.argv[1:]))
     w = Wrapper()
@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+
+#Clipped so very large distances do not overflow exp
+def sigmoid(z):
+    return 1 / (1 + np.exp(-np.clip(z, -500, 500)))
+
+def softmax(z):
+    e = np.exp(z - z.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+def relu(z):
+    return np.maximum(z, 0)
+
+def linear(z):
+    return z
+
+ACTIVATIONS = {'sigmoid': sigmoid, 'softmax': softmax, 'relu': relu,
+               'tanh': np.tanh, 'linear': linear}
+
+#The same functions for a single value, used by action(). Softmax is left
+#out, it never changes which output is largest.
+SCALAR_ACTIVATIONS = {'sigmoid': lambda z: 1 / (1 + math.exp(-max(min(z, 500), -500))),
+                      'relu': lambda z: z if z > 0 else 0.0,
+                      'tanh': math.tanh,
+                      'linear': lambda z: z}
+
+class DensePolicy():
+    #Forward pass of a stack of Dense layers (like the network.py model) in
+    #NumPy, so picking an action needs no Keras call. The weights are copied
+    #out of the model with load() and have to be loaded again after every
+    #fit() to stay the same as the model's.
+
+    def __init__(self, layers=None):
+        self.layers = []
+        self.scalar_layers = []
+        if layers is not None:
+            self.setLayers(layers)
+
+    #layers is a list of (kernel, bias, activation name), the kernel shaped
+    #(inputs, outputs) like Keras keeps it
+    def setLayers(self, layers):
+        self.layers = [(np.array(kernel, dtype=np.float64), np.array(bias, dtype=np.float64),
+                        activation) for kernel, bias, activation in layers]
+        #Plain Python lists of the same weights, faster than NumPy for one input
+        self.scalar_layers = [(kernel.T.tolist(), bias.tolist(), activation)
+                              for kernel, bias, activation in self.layers]
+
+    def load(self, model):
+        weights = model.get_weights()
+        activations = [layer.get_config()['activation'] for layer in model.layers]
+        self.setLayers([(weights[2*i], weights[2*i+1], activation)
+                        for i, activation in enumerate(activations)])
+
+    #Saves the layers to an .npz file that loadWeights() reads back, so the
+    #policy can be used without Keras
+    def saveWeights(self, path):
+        arrays = {}
+        for i, (kernel, bias, activation) in enumerate(self.layers):
+            arrays['kernel_%d' % i] = kernel
+            arrays['bias_%d' % i] = bias
+            arrays['activation_%d' % i] = np.array(activation)
+        f = open(path, 'wb')
+        np.savez(f, **arrays)
+        f.close()
+
+    def loadWeights(self, path):
+        data = np.load(path)
+        layers = []
+        while 'kernel_%d' % len(layers) in data.files:
+            i = len(layers)
+            layers.append((data['kernel_%d' % i], data['bias_%d' % i], str(data['activation_%d' % i])))
+        data.close()
+        self.setLayers(layers)
+
+    def getWeights(self):
+        return [(kernel, bias, activation) for kernel, bias, activation in self.layers]
+
+    #Output of the last layer for a batch of inputs, what model.predict gives
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        for kernel, bias, activation in self.layers:
+            x = ACTIVATIONS[activation](x.dot(kernel) + bias)
+        return x
+
+    #Index of the largest output for every input, what predict_classes gives
+    def act(self, x):
+        return self.predict(x).argmax(axis=1)
+
+    #act() for a single input given as a list of values (or one number)
+    def action(self, x):
+        if not isinstance(x, (list, tuple)):
+            x = [x]
+        last = len(self.scalar_layers) - 1
+        for i, (kernel, bias, activation) in enumerate(self.scalar_layers):
+            x = [sum(w*v for w, v in zip(row, x)) + b for row, b in zip(kernel, bias)]
+            if i != last or activation != 'softmax':
+                x = [SCALAR_ACTIVATIONS[activation](v) for v in x]
+        return x.index(max(x))
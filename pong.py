@@ -1,5 +1,7 @@
-import pygame, sys, ast
-from pygame.locals import *
+import sys, os, ast, time
+
+#pygame is only imported once something has to be drawn, see loadPygame()
+pygame = None
 
 #Set up the colors
 BLACK = (0, 0, 0)
@@ -16,13 +18,20 @@ window_height = 700
 #Line thickness set to 20
 line_thickness = 20
 
-#Create the main window with the given dimensions
-display_surf = pygame.display.set_mode((window_width, window_height+low_bar_size))
-
-#Set frames per second on the game clock
-fps_clock = pygame.time.Clock()
+#The main window and the game clock, made by initDisplay() the first time
+#a game is drawn
+display_surf = None
+fps_clock = None
 fps = 200 # Number of frames per second
 
+#How often the screen is redrawn, in frames per second of real time. With 0
+#it is redrawn after every frame and the clock holds the game to fps, any
+#other value lets the physics run as fast as it can in between.
+render_fps = 0
+
+#Number of frames each action chosen by the wrapper is repeated for
+action_repeat = 1
+
 game = None
 
 #Whether or not the ball path lines are visible
@@ -34,13 +43,114 @@ user_controlled = True
 #Whether the game stats are being displayed or not
 show_stats = False
 
+#Whether controlled_run times each part of the main loop (see Profiler)
+profiling = False
+
+#Whether the game runs without a window (physics only, no drawing)
+headless = False
+
+#File the settings are kept in, and its contents once it has been read
+settings_file = "settings.txt"
+saved_settings = None
+
+#Settings given for this run only (see readOverrides), never saved
+overrides = {}
+
+#Names of the settings kept in the settings file
+SETTINGS = ('fps', 'lines', 'speed', 'user_controlled', 'show_stats', 'render_fps',
+            'action_repeat', 'profile')
+
+def loadPygame():
+    global pygame
+    if pygame is None:
+        import pygame
+    return pygame
+
+#Creates the main window with the given dimensions and the game clock
+def initDisplay():
+    global display_surf
+    global fps_clock
+    if display_surf is None:
+        loadPygame()
+        pygame.init()
+        display_surf = pygame.display.set_mode((window_width, window_height+low_bar_size))
+        pygame.display.set_caption('Pong')
+        fps_clock = pygame.time.Clock()
+
+class Rect():
+    #Rectangle used for the ball and paddles so that the physics does not
+    #need pygame. Behaves like pygame.Rect for everything the game uses, and
+    #can be passed to pygame wherever a rectangle is expected.
+    __slots__ = ('x', 'y', 'w', 'h')
+    
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+    
+    @property
+    def left(self):
+        return self.x
+    
+    @property
+    def right(self):
+        return self.x + self.w
+    
+    @property
+    def top(self):
+        return self.y
+    
+    @top.setter
+    def top(self, value):
+        self.y = value
+    
+    @property
+    def bottom(self):
+        return self.y + self.h
+    
+    @bottom.setter
+    def bottom(self, value):
+        self.y = value - self.h
+    
+    @property
+    def centerx(self):
+        return self.x + self.w // 2
+    
+    @property
+    def centery(self):
+        return self.y + self.h // 2
+    
+    #Same test as pygame.Rect.colliderect
+    def colliderect(self, other):
+        return (self.x < other.x + other.w and self.y < other.y + other.h and
+                self.x + self.w > other.x and self.y + self.h > other.y)
+    
+    def __len__(self):
+        return 4
+    
+    def __getitem__(self, i):
+        return (self.x, self.y, self.w, self.h)[i]
+
+class GameState():
+    #Everything that changes while a game is played, see Game.snapshot().
+    #The speed is a setting and is not part of it.
+    __slots__ = ('ball_x', 'ball_y', 'dir_x', 'dir_y', 'end', 'user_y', 'computer_y',
+                 'hits', 'computer_hits', 'wins', 'losses')
+
 class Game():
     #Class is used to create and update the arena along with its contents
     
-    def __init__(self, line_thickness=20, speed=1, iteration=0):
+    #With self_play the computer paddle is an ordinary Paddle that is moved
+    #from outside like the user's, see controlled_run
+    def __init__(self, line_thickness=20, speed=1, iteration=0, self_play=False):
+        if not headless:
+            initDisplay()
         self.line_thickness = line_thickness
         self.speed = speed
+        self.self_play = self_play
         self.hits = 0
+        self.computer_hits = 0
         self.wins = 0
         self.losses = 0
         self.iteration = iteration
@@ -58,13 +168,189 @@ class Game():
         computer_paddle_x = 40
         self.paddles['user'] = Paddle(user_paddle_x,
                                       paddle_width, paddle_height)
-        self.paddles['computer'] = AutoPaddle(computer_paddle_x,
-                                              paddle_width, paddle_height,
-                                              self.ball, self.speed)
+        if self_play:
+            self.paddles['computer'] = Paddle(computer_paddle_x,
+                                              paddle_width, paddle_height)
+        else:
+            self.paddles['computer'] = AutoPaddle(computer_paddle_x,
+                                                  paddle_width, paddle_height,
+                                                  self.ball, self.speed)
         self.scoreboard = Scoreboard(0, 0, 0, iteration=self.iteration)
         
         self.settings = Settings(self)
         
+        #The static parts of the screen are drawn once into the background
+        #and copied back from there. Each frame only the areas that changed
+        #are redrawn and listed in dirty_rects for pygame.display.update().
+        self.background = None
+        self.drawn_rects = []
+        self.dirty_rects = []
+        self.lines_drawn = False
+        self.stats_drawn = False
+        
+    #Starts a new game with the objects already made for the last one
+    def reset(self, iteration=0):
+        self.hits = 0
+        self.computer_hits = 0
+        self.wins = 0
+        self.losses = 0
+        self.iteration = iteration
+        self.ball.reset()
+        self.paddles['user'].reset()
+        self.paddles['computer'].reset()
+        self.scoreboard.iteration = iteration
+        self.scoreboard.hits = 0
+        self.scoreboard.wins = 0
+        self.scoreboard.losses = 0
+
+    #Copies the state of the game into state, or a new GameState if none is
+    #given, so it can be put back with restore(). Reusing one GameState for
+    #every snapshot allocates nothing.
+    def snapshot(self, state=None):
+        if state is None:
+            state = GameState()
+        ball = self.ball
+        state.ball_x = ball.rect.x
+        state.ball_y = ball.rect.y
+        state.dir_x = ball.dir_x
+        state.dir_y = ball.dir_y
+        #The end point is a tuple, so it can be shared and not recomputed
+        state.end = ball.end
+        state.user_y = self.paddles['user'].rect.y
+        state.computer_y = self.paddles['computer'].rect.y
+        state.hits = self.hits
+        state.computer_hits = self.computer_hits
+        state.wins = self.wins
+        state.losses = self.losses
+        return state
+
+    #Puts the game back into a state taken by snapshot()
+    def restore(self, state):
+        ball = self.ball
+        ball.rect.x = state.ball_x
+        ball.rect.y = state.ball_y
+        ball.dir_x = state.dir_x
+        ball.dir_y = state.dir_y
+        ball.end = state.end
+        self.paddles['user'].rect.y = state.user_y
+        self.paddles['computer'].rect.y = state.computer_y
+        self.hits = state.hits
+        self.computer_hits = state.computer_hits
+        self.wins = state.wins
+        self.losses = state.losses
+
+    #Fills observation (a list or array of 6) with the user paddle's centre
+    #y, the ball's centre x and y, the end x and y of its path and the score.
+    #For the computer paddle the x values are mirrored and the times scored
+    #and scored on are swapped, so it sees the game the way the user does.
+    def observe(self, observation, side='user'):
+        end_x, end_y = self.ball.getEnd()
+        observation[0] = self.paddles[side].rect.centery
+        observation[2] = self.ball.rect.centery
+        observation[4] = end_y
+        if side == 'user':
+            observation[1] = self.ball.rect.centerx
+            observation[3] = end_x
+            observation[5] = self.hits + self.wins - self.losses
+        else:
+            observation[1] = window_width - self.ball.rect.centerx
+            observation[3] = window_width - end_x
+            observation[5] = self.computer_hits + self.losses - self.wins
+        return observation
+
+    #Plays the given number of frames, moving the user paddle by user_move
+    #before each one like controlled_run does, and returns how many were
+    #played. Stops early after a frame where a point was scored. Frames in
+    #which nothing can happen (the ball is away from the walls and the
+    #paddle columns and the computer paddle keeps going the same way) are
+    #jumped over in one go, the rest are played one by one with step(), so
+    #it ends up exactly where stepping frame by frame would.
+    #In self play the computer paddle is moved by computer_move the same way.
+    def advance(self, frames, user_move=0, computer_move=0):
+        done = 0
+        wins, losses = self.wins, self.losses
+        #Working out the quiet frames costs more than stepping a single one
+        if frames == 1:
+            self.paddles['user'].move(user_move)
+            if self.self_play:
+                self.paddles['computer'].move(computer_move)
+            self.step()
+            return 1
+        while done < frames:
+            n = min(self.quietFrames(), frames - done)
+            if n > 0:
+                self.jump(n, user_move, computer_move)
+                done += n
+            else:
+                self.paddles['user'].move(user_move)
+                if self.self_play:
+                    self.paddles['computer'].move(computer_move)
+                self.step()
+                done += 1
+                if self.wins != wins or self.losses != losses:
+                    break
+        return done
+
+    #Number of frames from now in which nothing but straight line movement
+    #can happen: no bounce, no point and no paddle hit, and the computer
+    #paddle neither turns around nor stops at the edge
+    def quietFrames(self):
+        ball = self.ball
+        rect = ball.rect
+        s = ball.speed
+        dx = ball.dir_x*s
+        dy = ball.dir_y*s
+        
+        #Ceiling or floor
+        if ball.dir_y == -1:
+            n = framesAbove(rect.y, dy, ball.w)
+        else:
+            n = framesBelow(rect.y + rect.h, dy, window_height - ball.w)
+        #Side walls, which is also where points are scored
+        n = min(n, framesAbove(rect.x, dx, ball.w),
+                framesBelow(rect.x + rect.w, dx, window_width - ball.w))
+        #Paddles, by staying out of the columns they move up and down in
+        for paddle in self.paddles.values():
+            p = paddle.rect
+            n = min(n, max(framesBelow(rect.x + rect.w, dx, p.x + 1),
+                           framesAbove(rect.x, dx, p.x + p.w - 1)))
+        
+        #The computer paddle only moves while the ball comes towards it,
+        #up while its centre is above the ball's and down otherwise
+        computer = self.paddles['computer']
+        if ball.dir_x == -1 and n > 0 and not self.self_play:
+            p = computer.rect
+            difference = p.centery - (rect.centery + dy)
+            up = difference < 0
+            move = computer.speed if up else -computer.speed
+            #How the difference changes each frame while it moves that way
+            change = move - dy
+            if up:
+                n = min(n, framesBelow(difference - change, change, 0))
+            else:
+                n = min(n, framesAbove(difference - change, change, -1))
+            n = min(n, framesBelow(p.y + p.h, move, window_height - computer.w + 1),
+                    framesAbove(p.y, move, computer.w - 1))
+        return n
+
+    #Moves everything n frames along a straight line, see quietFrames()
+    def jump(self, n, user_move=0, computer_move=0):
+        ball = self.ball
+        computer = self.paddles['computer']
+        if self.self_play:
+            computer.rect.y += computer_move*n
+            computer.clamp()
+        elif ball.dir_x == -1:
+            if computer.rect.centery < ball.rect.centery + ball.dir_y*ball.speed:
+                computer.rect.y += computer.speed*n
+            else:
+                computer.rect.y -= computer.speed*n
+        ball.rect.x += ball.dir_x*ball.speed*n
+        ball.rect.y += ball.dir_y*ball.speed*n
+        #Clamped every frame, which for a steady move is the same as once
+        user = self.paddles['user']
+        user.rect.y += user_move*n
+        user.clamp()
 
     #Draws the arena the game will be played in. 
     def draw_arena(self):
@@ -82,11 +368,26 @@ class Game():
         self.settings.drawBar()
 
     def update(self):
+        self.step()
+        if not headless:
+            self.draw()
+
+    #Advances the physics by one frame without drawing anything
+    #A profiler can be given to time each part of the step
+    def step(self, profiler=None):
+        if profiler is not None:
+            t = time.perf_counter()
         self.ball.move()
-        self.paddles['computer'].move()
+        if profiler is not None:
+            t = profiler.add('ball_move', t)
+        if not self.self_play:
+            self.paddles['computer'].move()
+        if profiler is not None:
+            t = profiler.add('computer_move', t)
 
         if self.ball.hit_paddle(self.paddles['computer']):
             self.ball.bounce('x')
+            self.computer_hits += 1
         elif self.ball.hit_paddle(self.paddles['user']):
             self.ball.bounce('x')
             self.hits += 1
@@ -95,31 +396,90 @@ class Game():
         elif self.ball.pass_player():
             self.wins += 1
 
-        self.draw_arena()
-        self.ball.draw()
-        self.paddles['user'].draw()
-        self.paddles['computer'].draw()
-        self.scoreboard.display(self.hits, self.wins, self.losses)
-        self.settings.updateLabels()
+        self.paddles['user'].clamp()
+        self.paddles['computer'].clamp()
+        if profiler is not None:
+            profiler.add('collisions', t)
+
+    def draw(self):
+        objects = [self.ball, self.paddles['user'], self.paddles['computer']]
+        
+        #The path lines cover too much of the screen to track, and turning
+        #the lines or stats on and off changes everything
+        if (self.background is None or visible or self.lines_drawn or
+                self.stats_drawn != show_stats):
+            if self.background is None:
+                self.draw_arena()
+                self.background = display_surf.copy()
+            else:
+                display_surf.blit(self.background, (0, 0))
+            self.settings.updateLabels()
+            self.settings.drawLabels()
+            for item in objects:
+                item.draw()
+            self.scoreboard.display(self.hits, self.wins, self.losses)
+            self.dirty_rects = [display_surf.get_rect()]
+        else:
+            #Put the background back where things were on the last frame
+            erase = list(self.drawn_rects)
+            redraw_stats = False
+            if show_stats:
+                changed = self.scoreboard.render(self.hits, self.wins, self.losses)
+                if changed or self.scoreboard.rect.collidelist(erase + [self.ball.rect]) != -1:
+                    erase.append(self.scoreboard.rect)
+                    redraw_stats = True
+            for rect in erase:
+                display_surf.blit(self.background, rect, rect)
+            
+            for item in objects:
+                item.draw()
+            self.dirty_rects = erase + [pygame.Rect(tuple(item.rect)) for item in objects]
+            if redraw_stats:
+                self.scoreboard.display(self.hits, self.wins, self.losses)
+                self.dirty_rects.append(self.scoreboard.rect)
+            self.dirty_rects += self.settings.updateLabels()
+        
+        self.drawn_rects = [pygame.Rect(tuple(item.rect)) for item in objects]
+        self.lines_drawn = visible
+        self.stats_drawn = show_stats
+
+#Number of frames k = 1, 2, ... in a row for which start + k*step < limit,
+#infinite if it never stops being true
+def framesBelow(start, step, limit):
+    if start + step >= limit:
+        return 0
+    if step <= 0:
+        return float('inf')
+    return (limit - start - 1) // step
+
+#Same for start + k*step > limit
+def framesAbove(start, step, limit):
+    return framesBelow(-start, -step, -limit)
 
-class Paddle(pygame.sprite.Sprite):
+class Paddle():
     def __init__(self,x,w,h):
         self.x = x
         self.w = w
         self.h = h
         self.y = int(window_height / 2 - self.h / 2)
         #Creates Rectangle for paddle.
-        self.rect = pygame.Rect(self.x, self.y, self.w, self.h)
+        self.rect = Rect(self.x, self.y, self.w, self.h)
 
-    #Draws the paddle
-    def draw(self):
+    #Puts the paddle back where it started
+    def reset(self):
+        self.rect.y = self.y
+
+    #Keeps the paddle inside the arena
+    def clamp(self):
         #Stops paddle moving too low
         if self.rect.bottom > window_height - self.w:
             self.rect.bottom = window_height - self.w
         #Stops paddle moving too high
         elif self.rect.top < self.w:
             self.rect.top = self.w
-        #Draws paddle
+
+    #Draws the paddle
+    def draw(self):
         pygame.draw.rect(display_surf, WHITE, self.rect)
 
     #Moves the paddle
@@ -140,7 +500,7 @@ class AutoPaddle(Paddle):
             else:
                 self.rect.y -= self.speed
 
-class Ball(pygame.sprite.Sprite):
+class Ball():
     def __init__(self,x,y,w,h,speed):
         self.x = x
         self.y = y
@@ -149,13 +509,34 @@ class Ball(pygame.sprite.Sprite):
         self.speed = speed
         self.dir_x = -1  ## -1 = left 1 = right
         self.dir_y = -1 ## -1 = up 1 = down
-        self.rect = pygame.Rect(self.x, self.y, self.w, self.h)
+        self.rect = Rect(self.x, self.y, self.w, self.h)
         self.path = Path(self.rect.centerx, self.rect.centery, self.dir_x, self.dir_y)
+        #Where the ball will end up, only worked out again after it changes
+        #direction or is put back in the middle
+        self.end = None
 
     #draws the ball
     def draw(self):
-        self.path.update(self.rect.centerx, self.rect.centery, self.dir_x, self.dir_y)
+        #The path chain is only needed for drawing the lines
+        if visible:
+            self.path.update(self.rect.centerx, self.rect.centery, self.dir_x, self.dir_y)
+            self.path.draw()
         pygame.draw.rect(display_surf, WHITE, self.rect)
+
+    #Puts the ball back where it started, heading the same way
+    def reset(self):
+        self.rect.x = self.x
+        self.rect.y = self.y
+        self.dir_x = -1
+        self.dir_y = -1
+        self.end = None
+
+    #Returns the end point of the ball's path, same as Path.getAbsoluteEnd()
+    def getEnd(self):
+        if self.end is None:
+            self.end = predictEnd(self.rect.centerx, self.rect.centery,
+                                  self.dir_x, self.dir_y)
+        return self.end
         
 
     #moves the ball returns new position
@@ -170,6 +551,7 @@ class Ball(pygame.sprite.Sprite):
             self.bounce('x')
 
     def bounce(self,axis):
+        self.end = None
         if axis == 'x':
             self.dir_x *= -1
         elif axis == 'y':
@@ -177,7 +559,7 @@ class Ball(pygame.sprite.Sprite):
 
     def hit_paddle(self,paddle):
         
-        if pygame.sprite.collide_rect(self,paddle):
+        if self.rect.colliderect(paddle.rect):
             return True
         else:
             return False
@@ -205,6 +587,7 @@ class Ball(pygame.sprite.Sprite):
         if self.rect.left <= self.w:
             self.rect.x = int(window_width/2)
             self.rect.y = int(window_height/2)
+            self.end = None
             return True
         else:
             return False
@@ -213,11 +596,60 @@ class Ball(pygame.sprite.Sprite):
         if self.rect.right >= window_width - self.w:
             self.rect.x = int(window_width/2)
             self.rect.y = int(window_height/2)
+            self.end = None
             return True
         else:
             return False
         
-class Path(pygame.sprite.Sprite):
+#Works out the same end point as Path.getAbsoluteEnd() without stepping
+#along the path. Between the first and last bounce the ball goes from one
+#wall to the other in legs of the same length, so those can be skipped
+#over with a division instead of following them pixel by pixel.
+def predictEnd(x, y, dir_x, dir_y):
+    left = line_thickness+2
+    right = window_width-line_thickness-2
+    top = line_thickness*1.5
+    bottom = window_height-(line_thickness*1.5)
+    
+    #Number of steps until the ball reaches one of the end columns. A ball
+    #already past both of them never gets there, so it ends where it is.
+    to_end = [(end - x)*dir_x for end in (left, right) if (end - x)*dir_x >= 0]
+    remaining = min(to_end) if len(to_end) > 0 else 0
+    end_x = x + dir_x*remaining
+    
+    while True:
+        to_wall = [(wall - y)*dir_y for wall in (top, bottom) if (wall - y)*dir_y >= 0]
+        if len(to_wall) == 0 or remaining < min(to_wall):
+            end_y = y + dir_y*remaining
+            break
+        
+        #Bounce the same way getEnd() does, one pixel back from the wall
+        remaining -= min(to_wall)
+        wall = y + dir_y*min(to_wall)
+        if wall == top:
+            y = wall + 1
+        else:
+            y = wall - 1
+        dir_y *= -1
+        
+        #Every leg from here on is the same length
+        if (y == top + 1 and dir_y == 1) or (y == bottom - 1 and dir_y == -1):
+            leg = bottom - top - 1
+            bounces = remaining // leg
+            remaining -= bounces*leg
+            if bounces % 2 == 1:
+                y = top + bottom - y
+                dir_y *= -1
+            end_y = y + dir_y*remaining
+            break
+    
+    if dir_y == -1:
+        end_y = end_y + 40
+    else:
+        end_y = end_y - 40
+    return end_x, int(end_y)
+    
+class Path():
     def __init__(self, x, y, dir_x, dir_y):
         self.x = x
         self.y = y
@@ -265,7 +697,6 @@ class Path(pygame.sprite.Sprite):
         self.dir_x = dir_x
         self.dir_y = dir_y
         self.end_x, self.end_y = self.getEnd()
-        self.draw()
         
     def draw(self):
         global visible
@@ -285,7 +716,52 @@ class Scoreboard():
         self.x = x
         self.y = y
         self.iteration = iteration
-        self.font = pygame.font.Font('freesansbold.ttf', font_size)
+        #Text of each line with its rendered surface, and the area they cover
+        self.texts = []
+        self.rect = None
+        #Set while controlled_run is profiling, its live timings are shown
+        #under the stats
+        self.profiler = None
+        #No fonts are needed when nothing is drawn
+        if not headless:
+            self.font = pygame.font.Font('freesansbold.ttf', font_size)
+
+    def lines(self):
+        if (self.hits > 0 and self.losses > 0):
+            hitsperloss = float(self.hits)/float(self.losses)
+        elif self.hits > 0:
+            hitsperloss = self.hits
+        else:
+            hitsperloss = 0
+        
+        lines = ['Iteration: ' + str(self.iteration),
+                 'Hits: ' + str(self.hits),
+                 'Times Scored: ' + str(self.wins),
+                 'Times Scored on: ' + str(self.losses),
+                 'Hits per Lost Point: %.2f' %(hitsperloss)]
+        if self.profiler is not None:
+            lines += self.profiler.live
+        return lines
+
+    #Renders the lines whose text has changed, returns whether any did
+    def render(self, hits, wins, losses):
+        self.hits = hits
+        self.wins = wins
+        self.losses = losses
+        changed = False
+        lines = self.lines()
+        for i, text in enumerate(lines):
+            if i >= len(self.texts) or self.texts[i][0] != text:
+                result_surf = self.font.render(text, True, WHITE)
+                if i >= len(self.texts):
+                    self.texts.append((text, result_surf))
+                else:
+                    self.texts[i] = (text, result_surf)
+                changed = True
+        if len(self.texts) > len(lines):
+            del self.texts[len(lines):]
+            changed = True
+        return changed
 
     #Displays the current score on the screen
     def display(self, hits, wins, losses):
@@ -293,54 +769,88 @@ class Scoreboard():
         self.wins = wins
         self.losses = losses
         if show_stats:
-            result_surf = self.font.render('Iteration: ' + str(self.iteration), True, WHITE)
-            rect = result_surf.get_rect()
-            rect.topleft = (self.x, self.y)
-            display_surf.blit(result_surf, rect)
-            
-            result_surf = self.font.render('Hits: ' + str(self.hits), True, WHITE)
-            rect = result_surf.get_rect()
-            rect.topleft = (self.x, self.y+20)
-            display_surf.blit(result_surf, rect)
-            
-            result_surf = self.font.render('Times Scored: ' + str(self.wins), True, WHITE)
-            rect = result_surf.get_rect()
-            rect.topleft = (self.x, self.y+40)
-            display_surf.blit(result_surf, rect)
-            
-            result_surf = self.font.render('Times Scored on: ' + str(self.losses), True, WHITE)
-            rect = result_surf.get_rect()
-            rect.topleft = (self.x, self.y+60)
-            display_surf.blit(result_surf, rect)
-            
-            if (self.hits > 0 and self.losses > 0):
-                hitsperloss = float(self.hits)/float(self.losses)
-            elif self.hits > 0:
-                hitsperloss = self.hits
-            else:
-                hitsperloss = 0
-                
-            result_surf = self.font.render('Hits per Lost Point: %.2f' %(hitsperloss), True, WHITE)
-            rect = result_surf.get_rect()
-            rect.topleft = (self.x, self.y+80)
-            display_surf.blit(result_surf, rect)
+            self.render(hits, wins, losses)
+            rects = []
+            for i in range(len(self.texts)):
+                result_surf = self.texts[i][1]
+                rect = result_surf.get_rect()
+                rect.topleft = (self.x, self.y+20*i)
+                display_surf.blit(result_surf, rect)
+                rects.append(rect)
+            self.rect = rects[0].unionall(rects[1:])
             
+class Profiler():
+    #Adds up the time spent in each part (phase) of the main loop and how
+    #often it ran. Timing is done by passing the time a phase started to
+    #add(), which hands back the time the next phase starts at.
+    
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        #Short summary shown with the stats, refreshed once a second
+        self.live = []
+        self.last_live = time.perf_counter()
+    
+    def add(self, phase, start):
+        now = time.perf_counter()
+        if phase in self.times:
+            self.times[phase] += now - start
+            self.calls[phase] += 1
+        else:
+            self.times[phase] = now - start
+            self.calls[phase] = 1
+        return now
+    
+    def updateLive(self):
+        now = time.perf_counter()
+        if now - self.last_live >= 1:
+            self.last_live = now
+            phases = sorted(self.times, key=self.times.get, reverse=True)[:5]
+            self.live = ['%s: %.1f us' % (phase, self.times[phase]/self.calls[phase]*1e6)
+                         for phase in phases]
+    
+    def summary(self):
+        total = sum(self.times.values())
+        lines = ['%-16s %10s %10s %10s %7s' % ('phase', 'calls', 'total s', 'avg us', '%')]
+        for phase in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append('%-16s %10d %10.3f %10.1f %6.1f%%' % (
+                phase, self.calls[phase], self.times[phase],
+                self.times[phase]/self.calls[phase]*1e6,
+                100*self.times[phase]/total if total > 0 else 0))
+        return '\n'.join(lines)
+    
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.live = []
+        
 class Settings():
     def __init__(self, game):
         global low_bar_size
         self.game = game
         self.bar_size = low_bar_size
-        self.font = pygame.font.SysFont("nirmalaui", 15)
         self.buttons = {}
         self.labels = []
         self.label_rects = []
-        self.initializeButtons()
+        self.label_texts = []
+        if not headless:
+            self.font = pygame.font.SysFont("nirmalaui", 15)
+            self.initializeButtons()
         self.loadSettings()
     
+    #Renders and draws the labels whose value changed and returns the
+    #areas of the screen that were drawn on
     def updateLabels(self):
-        self.labels[0] = self.font.render("Speed: " + str(self.game.speed), True, BLACK)
-        self.labels[1] = self.font.render("FPS: " + str(fps), True, BLACK)
-        self.drawLabels()
+        texts = ["Speed: " + str(self.game.speed), "FPS: " + str(fps)]
+        dirty = []
+        for i in range(len(texts)):
+            if texts[i] != self.label_texts[i]:
+                self.label_texts[i] = texts[i]
+                self.labels[i] = self.font.render(texts[i], True, BLACK)
+                pygame.draw.rect(display_surf, WHITE, self.label_rects[i])
+                display_surf.blit(self.labels[i], self.label_rects[i])
+                dirty.append(self.label_rects[i])
+        return dirty
         
     def addButton(self, button):
         self.buttons[button.name] = button
@@ -369,6 +879,7 @@ class Settings():
         
         self.labels.append(speed_label)
         self.label_rects.append(speed_rect)
+        self.label_texts.append("Speed: " + str(self.game.speed))
         
         speed_up = Button('speed_up', speed_down.x + speed_down.w + line_thickness*2 + 70, speed_down.y, speed_down.w, speed_down.h, GRAY, "+")
         self.addButton(speed_up)
@@ -381,6 +892,7 @@ class Settings():
         
         self.labels.append(fps_label)
         self.label_rects.append(fps_rect)
+        self.label_texts.append("FPS: " + str(fps))
         
         fps_up = Button('fps_up', fps_down.x + fps_down.w + line_thickness*2 + 70, speed_up.y, speed_up.w, speed_up.h, GRAY, "+")
         self.addButton(fps_up)
@@ -394,32 +906,89 @@ class Settings():
         stats = Button('stats', lines.x + lines.w + line_thickness, lines.y, lines.w, lines.h, GRAY, "Toggle Stats")
         self.addButton(stats)
         
+        profile = Button('profile', stats.x + stats.w + line_thickness, stats.y, stats.w, stats.h, GRAY, "Toggle Profile")
+        self.addButton(profile)
+        
+    #The file is only read the first time, later games use the copy kept
+    #in memory. Environment variables (PONG_FPS, PONG_SPEED, ...) and the
+    #overrides dict then take the place of the saved values for this run.
     def loadSettings(self):
-        f = open("settings.txt", "r")
-        self.settings = ast.literal_eval(f.readline())
-        f.close()
+        global saved_settings
+        if saved_settings is None:
+            saved_settings = {'fps': fps, 'lines': visible, 'speed': self.game.speed,
+                              'user_controlled': user_controlled, 'show_stats': show_stats,
+                              'render_fps': render_fps, 'action_repeat': action_repeat,
+                              'profile': profiling}
+            saved_settings.update(readSettingsFile())
+        self.settings = dict(saved_settings)
         
-        self.updateFPS(self.settings['fps'])
-        self.toggleLines(self.settings['lines'])
-        self.updateSpeed(self.settings['speed'])
-        self.toggleControl(self.settings['user_controlled'])
-        self.toggleStats(self.settings['show_stats'])
+        self.run_settings = {}
+        for key in self.settings:
+            if "PONG_" + key.upper() in os.environ:
+                self.run_settings[key] = ast.literal_eval(os.environ["PONG_" + key.upper()])
+        #Anything else in overrides is not a setting, and is left out so it
+        #never reaches the settings file
+        for key in overrides:
+            if key in self.settings:
+                self.run_settings[key] = overrides[key]
+        
+        values = dict(self.settings)
+        values.update(self.run_settings)
+        self.updateFPS(values['fps'])
+        self.toggleLines(values['lines'])
+        self.updateSpeed(values['speed'])
+        self.toggleControl(values['user_controlled'])
+        self.toggleStats(values['show_stats'])
+        self.updateRenderFPS(values['render_fps'])
+        self.updateActionRepeat(values['action_repeat'])
+        self.toggleProfile(values['profile'])
+        self.dirty = False
     
+    #Writes the settings out if any of them changed since the last save. The
+    #file is replaced in one go so it is never left half written.
     def saveSettings(self):
-        f = open("settings.txt", "w")
-        f.write(str(self.settings))
+        if not self.dirty:
+            return
+        global saved_settings
+        values = dict(self.settings)
+        #Settings given for this run only keep the value they had in the file
+        for key in self.run_settings:
+            values[key] = saved_settings[key]
+        f = open(settings_file + ".tmp", "w")
+        f.write(str(values))
         f.close()
+        os.replace(settings_file + ".tmp", settings_file)
+        saved_settings = values
+        self.dirty = False
+    
+    #Marks the settings as needing a save when a value really changes
+    def changeSetting(self, key, new):
+        if self.settings.get(key) != new:
+            self.settings[key] = new
+            self.dirty = True
     
     def updateFPS(self, new):
         if new > 0 and new <= 1500:
             global fps
             fps = new
-            self.settings['fps'] = new
+            self.changeSetting('fps', new)
+        
+    def updateRenderFPS(self, new):
+        if new >= 0:
+            global render_fps
+            render_fps = new
+            self.changeSetting('render_fps', new)
+        
+    def updateActionRepeat(self, new):
+        if new >= 1:
+            global action_repeat
+            action_repeat = new
+            self.changeSetting('action_repeat', new)
         
     def toggleLines(self, new):
         global visible
         visible = new
-        self.settings['lines'] = new
+        self.changeSetting('lines', new)
     
     def updateSpeed(self, new):
         if new >= 0 and new <= 15:
@@ -427,17 +996,63 @@ class Settings():
             self.game.ball.speed = new
             self.game.paddles['user'].speed = new
             self.game.paddles['computer'].speed = new
-            self.settings['speed'] = new
+            self.changeSetting('speed', new)
         
     def toggleControl(self, new):
         global user_controlled
         user_controlled = new
-        self.settings['user_controlled'] = new
+        self.changeSetting('user_controlled', new)
         
     def toggleStats(self, new):
         global show_stats
         show_stats = new
-        self.settings['show_stats'] = new
+        self.changeSetting('show_stats', new)
+        
+    def toggleProfile(self, new):
+        global profiling
+        profiling = new
+        self.changeSetting('profile', new)
+        
+#The settings saved in settings_file, empty if there are none
+def readSettingsFile():
+    if not os.path.exists(settings_file):
+        return {}
+    f = open(settings_file, "r")
+    line = f.readline()
+    f.close()
+    if line.strip() == "":
+        return {}
+    return ast.literal_eval(line)
+
+#The value a setting will have in the next game, looked up the same way
+#Settings.loadSettings() does: overrides, then PONG_ variables, then the
+#settings file. For code that plays without a Game, such as BatchGame.
+def currentSetting(key, default):
+    if key in overrides:
+        return overrides[key]
+    if "PONG_" + key.upper() in os.environ:
+        return ast.literal_eval(os.environ["PONG_" + key.upper()])
+    if saved_settings is not None:
+        return saved_settings.get(key, default)
+    return readSettingsFile().get(key, default)
+
+#Reads settings given on the command line as --name=value, for example
+#--fps=1000 or --lines=True, into a dict that can go into overrides. Names
+#that are not settings and values that are not Python literals are left
+#out with a message.
+def readOverrides(args):
+    values = {}
+    for arg in args:
+        if arg.startswith("--") and "=" in arg:
+            key, value = arg[2:].split("=", 1)
+            if key not in SETTINGS:
+                print("Ignoring unknown setting: " + key)
+                continue
+            try:
+                values[key] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                print("Ignoring " + arg + ", the value is not a Python literal")
+    return values
         
 class Button():
     def __init__(self, name, x, y, w, h, color, text):
@@ -464,10 +1079,15 @@ class Button():
             return False
 
 class RunGame():
+    def __init__(self):
+        #The game is made on the first controlled_run and reset after that
+        self.game = None
+        self.headless = None
+        self.profiler = Profiler()
+        
     #Main function
     def run():
-        pygame.init()
-        pygame.display.set_caption('Pong')
+        initDisplay()
         pygame.mouse.set_visible(0) # make cursor invisible
         
         global game
@@ -475,7 +1095,7 @@ class RunGame():
         
         while True: #main game loop
             for event in pygame.event.get():
-                if event.type == QUIT:
+                if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
             keys = pygame.key.get_pressed()
@@ -485,26 +1105,59 @@ class RunGame():
                 game.paddles['user'].move(game.speed)
     
             game.update()
-            pygame.display.update()
+            pygame.display.update(game.dirty_rects)
             fps_clock.tick(fps)
             
-    def controlled_run(self, wrapper, iteration):
-        pygame.init()
-        pygame.display.set_caption('Pong')
-        
+    #Plays one game driven by the wrapper and returns its score. Calling it
+    #again on the same RunGame reuses the game instead of building a new one.
+    #With a recorder (see recording.py) every frame the wrapper is asked about
+    #is recorded with the action it picked and the score gained after it.
+    #With self_play the computer paddle is played by the wrapper too: it is
+    #asked for both paddles' actions at once with wrapper.controlBoth(), given
+    #a list of the user's and the computer's observations (see Game.observe).
+    def controlled_run(self, wrapper, iteration, headless_mode=False, recorder=None,
+                       self_play=False):
+        global headless
         global game
-        game = Game(speed=1, iteration=iteration)
+        headless = headless_mode
+        if self.game is None or self.headless != headless or self.game.self_play != self_play:
+            self.game = Game(speed=1, iteration=iteration, self_play=self_play)
+            self.headless = headless
+        else:
+            self.game.reset(iteration)
+        game = self.game
         
         action = None
+        computer_action = None
+        observations = [[0]*6, [0]*6]
         
         hits = 0
         
+        frame = 0
+        last_render = time.perf_counter()
+        recorded_score = 0
+        
         while game.wins < 7 and game.losses < 7 and game.hits < 1000000000: #main game loop
-            for event in pygame.event.get():
-                if event.type == QUIT:
+            profiler = self.profiler if profiling else None
+            game.scoreboard.profiler = profiler
+            if profiler is not None:
+                t = time.perf_counter()
+            
+            #Whether this frame gets drawn, see render_fps
+            render = False
+            if not headless:
+                now = time.perf_counter()
+                if render_fps == 0 or now - last_render >= 1.0/render_fps:
+                    render = True
+                    last_render = now
+            
+            #Events are only taken from the window on frames that are drawn
+            for event in (pygame.event.get() if render else []):
+                if event.type == pygame.QUIT:
+                    game.settings.saveSettings()
                     pygame.quit()
                     sys.exit()
-                elif event.type == MOUSEBUTTONUP:
+                elif event.type == pygame.MOUSEBUTTONUP:
                     for button in game.settings.buttons.values():
                         if button.isClicked(event):
                             if button.name == "speed_down":
@@ -521,21 +1174,30 @@ class RunGame():
                                 game.settings.updateFPS(fps + 50)
                             elif button.name == "stats":
                                 game.settings.toggleStats(not show_stats)
+                            elif button.name == "profile":
+                                game.settings.toggleProfile(not profiling)
+            if profiler is not None:
+                t = profiler.add('events', t)
                         
             #User controls
-            if user_controlled:
+            keyboard = user_controlled and not headless
+            if keyboard:
                 keys = pygame.key.get_pressed()
                 if keys[pygame.K_UP]:
                     game.paddles['user'].move(-1*game.speed)
                 elif keys[pygame.K_DOWN]:
                     game.paddles['user'].move(game.speed)
-            else:
+            elif frame % action_repeat == 0 and not self_play:
                 values = dict()
                 values['last_action'] = action
                 values['paddle_position'] = game.paddles['user'].rect.centery
                 values['ball_y'] = game.ball.rect.centery
                 values['ball_x'] = game.ball.rect.centerx
-                throwaway, end_x, end_y = game.ball.path.getAbsoluteEnd()
+                if profiler is not None:
+                    t = profiler.add('observation', t)
+                end_x, end_y = game.ball.getEnd()
+                if profiler is not None:
+                    t = profiler.add('path', t)
                 values['ball_end_x'] = end_x
                 values['ball_end_y'] = end_y
                 values['score'] = game.hits + game.wins - game.losses
@@ -543,19 +1205,88 @@ class RunGame():
                 hits = game.hits
                 
                 action = wrapper.control(values)
+                if profiler is not None:
+                    t = profiler.add('control', t)
+                
+                if recorder is not None:
+                    recorder.reward(values['score'] - recorded_score)
+                    recorded_score = values['score']
+                    recorder.add((values['paddle_position'], values['ball_x'], values['ball_y'],
+                                  end_x, end_y, values['score']), action)
+            
+            #Both paddles are played by the wrapper, with one call
+            if self_play and frame % action_repeat == 0:
+                game.observe(observations[0], 'user')
+                game.observe(observations[1], 'computer')
+                if profiler is not None:
+                    t = profiler.add('observation', t)
+                actions = wrapper.controlBoth(observations)
+                if profiler is not None:
+                    t = profiler.add('control', t)
+                if not keyboard:
+                    action = actions[0]
+                computer_action = actions[1]
                 
+                if recorder is not None and not keyboard:
+                    recorder.reward(observations[0][5] - recorded_score)
+                    recorded_score = observations[0][5]
+                    recorder.add(observations[0], action)
+            
+            #The last action keeps being used until the wrapper is asked again
+            move = 0
+            if not keyboard:
                 if action == 1:
-                    game.paddles['user'].move(-1*game.speed)
+                    move = -1*game.speed
                 elif action == 0:
-                    game.paddles['user'].move(game.speed)
-            
+                    move = game.speed
+            computer_move = 0
+            if computer_action == 1:
+                computer_move = -1*game.speed
+            elif computer_action == 0:
+                computer_move = game.speed
             
-            game.update()
-            pygame.display.update()
-            fps_clock.tick(fps)
+            #Without a window nothing happens between two times the wrapper
+            #is asked, so those frames are played in one go
+            if headless and profiler is None:
+                frame += game.advance(action_repeat - frame % action_repeat, move, computer_move)
+            else:
+                game.paddles['user'].move(move)
+                if self_play:
+                    game.paddles['computer'].move(computer_move)
+                game.step(profiler)
+                frame += 1
+            if render:
+                if profiler is not None:
+                    profiler.updateLive()
+                    t = time.perf_counter()
+                game.draw()
+                if profiler is not None:
+                    t = profiler.add('draw', t)
+                pygame.display.update(game.dirty_rects)
+                if profiler is not None:
+                    t = profiler.add('display_update', t)
+                if render_fps == 0:
+                    fps_clock.tick(fps)
+                    if profiler is not None:
+                        t = profiler.add('clock_tick', t)
+            elif profiler is not None:
+                t = time.perf_counter()
         
+            #Only writes anything when a setting was changed
             game.settings.saveSettings()
-        wrapper.gameover(game.hits + (game.wins) - (game.losses))
+            if profiler is not None:
+                profiler.add('save_settings', t)
+        
+        if profiling:
+            print('Game %d profile:' % iteration)
+            print(self.profiler.summary())
+            self.profiler.reset()
+        score = game.hits + (game.wins) - (game.losses)
+        if recorder is not None:
+            recorder.reward(score - recorded_score)
+            recorder.endEpisode()
+        wrapper.gameover(score)
+        return score
             
             
 #RunGame.run()
\ No newline at end of file
@@ -0,0 +1,168 @@
+import json, os
+
+import numpy as np
+
+from memory import closerSamples
+
+#Every column is a flat binary file of fixed-width rows, one row per
+#recorded frame, so a recording can be memory-mapped straight back
+COLUMNS = {'observation': (np.float32, (6,)),
+           'action': (np.int8, ()),
+           'reward': (np.float32, ())}
+
+class TrajectoryWriter():
+    #Records frames of play into a directory of column files:
+    #
+    #  observation.bin  float32 x 6 per frame (see Game.observe)
+    #  action.bin       int8 per frame, -1 when there was no action
+    #  reward.bin       float32 per frame, the score gained after the action
+    #  episodes.bin     int64 per episode, the frame each episode ends at
+    #  meta.json        number of frames and episodes, and the column types
+    #
+    #Frames are gathered in arrays of chunk rows and written out when those
+    #fill up and at the end of every episode. An existing recording in the
+    #same directory is added to.
+
+    def __init__(self, path, chunk=4096):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.frames = 0
+        self.episodes = 0
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            meta = readMeta(path)
+            self.frames = meta['frames']
+            self.episodes = meta['episodes']
+            #Drop anything written after the last complete episode
+            for name in list(COLUMNS) + ['episodes']:
+                f = open(self.columnPath(name), 'ab')
+                f.truncate(self.columnSize(name))
+                f.close()
+
+        self.buffers = {}
+        for name, (dtype, shape) in COLUMNS.items():
+            self.buffers[name] = np.zeros((chunk,) + shape, dtype=dtype)
+        self.chunk = chunk
+        self.count = 0
+        self.files = {}
+        for name in list(COLUMNS) + ['episodes']:
+            self.files[name] = open(self.columnPath(name), 'ab')
+
+    def columnPath(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def columnSize(self, name):
+        if name == 'episodes':
+            return self.episodes * 8
+        dtype, shape = COLUMNS[name]
+        return self.frames * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+
+    #Adds a frame. Its reward starts at 0 and is filled in by reward()
+    def add(self, observation, action):
+        #The last frame stays behind, its reward may not be known yet
+        if self.count == self.chunk:
+            self.flush(self.count - 1)
+        i = self.count
+        self.buffers['observation'][i] = observation
+        self.buffers['action'][i] = -1 if action is None else action
+        self.buffers['reward'][i] = 0
+        self.count += 1
+
+    #Adds to the reward of the last frame
+    def reward(self, value):
+        if self.count > 0:
+            self.buffers['reward'][self.count - 1] += value
+
+    #Writes out the first n buffered frames
+    def flush(self, n=None):
+        if n is None:
+            n = self.count
+        for name in COLUMNS:
+            self.files[name].write(self.buffers[name][:n].tobytes())
+            self.buffers[name][:self.count - n] = self.buffers[name][n:self.count]
+        self.count -= n
+        self.frames += n
+
+    def endEpisode(self):
+        self.flush()
+        self.files['episodes'].write(np.array([self.frames], dtype=np.int64).tobytes())
+        self.episodes += 1
+        for f in self.files.values():
+            f.flush()
+        #The meta file only counts finished episodes, so a recording cut
+        #short is still read back up to its last complete episode
+        meta = {'frames': self.frames, 'episodes': self.episodes,
+                'columns': {name: [np.dtype(dtype).str, list(shape)]
+                            for name, (dtype, shape) in COLUMNS.items()}}
+        f = open(os.path.join(self.path, 'meta.json.tmp'), 'w')
+        json.dump(meta, f)
+        f.close()
+        os.replace(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        if self.count > 0:
+            self.endEpisode()
+        for f in self.files.values():
+            f.close()
+
+def readMeta(path):
+    f = open(os.path.join(path, 'meta.json'), 'r')
+    meta = json.load(f)
+    f.close()
+    return meta
+
+class Trajectories():
+    #A recording made by TrajectoryWriter, memory-mapped so nothing is read
+    #from disk until it is used.
+
+    def __init__(self, path):
+        meta = readMeta(path)
+        self.frames = meta['frames']
+        self.episodes = meta['episodes']
+        self.columns = {}
+        for name, (dtype, shape) in meta['columns'].items():
+            if self.frames == 0:
+                self.columns[name] = np.zeros((0,) + tuple(shape), dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype,
+                                               mode='r', shape=(self.frames,) + tuple(shape))
+        self.ends = np.fromfile(os.path.join(path, 'episodes.bin'), dtype=np.int64,
+                                count=self.episodes)
+        self.observation = self.columns['observation']
+        self.action = self.columns['action']
+        self.reward = self.columns['reward']
+
+    def __len__(self):
+        return self.frames
+
+    #Frame range of episode i
+    def episode(self, i):
+        start = 0 if i == 0 else int(self.ends[i-1])
+        return start, int(self.ends[i])
+
+    #Whether each frame is the last of its episode
+    def lastFrames(self):
+        last = np.zeros(self.frames, dtype=bool)
+        last[self.ends - 1] = True
+        return last
+
+    #The (distance, action) samples Wrapper.control() would have collected
+    #while these frames were played: the paddle to end point distance after
+    #each action that brought the paddle closer, with that action. The
+    #frames are read chunk frames at a time, only the samples are kept.
+    def samples(self, chunk=1048576):
+        distances = [np.zeros(0, dtype=np.float32)]
+        actions = [np.zeros(0, dtype=np.int8)]
+        for start in range(0, self.frames - 1, chunk):
+            #One frame past the chunk, for the result of its last action
+            stop = min(start + chunk + 1, self.frames)
+            observation = np.asarray(self.observation[start:stop])
+            distance = observation[:, 0] - observation[:, 4]
+            action = np.array(self.action[start:stop - 1])
+            #The action of an episode's last frame is never followed by its result
+            ends = self.ends[(self.ends > start) & (self.ends < stop)]
+            action[ends - 1 - start] = -1
+            keep = closerSamples(distance[:-1], distance[1:], action)
+            distances.append(distance[1:][keep])
+            actions.append(action[keep])
+        return np.concatenate(distances), np.concatenate(actions)
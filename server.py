@@ -0,0 +1,197 @@
+import argparse, multiprocessing, os, socket, struct, tempfile, time
+
+import numpy as np
+
+from batch import BatchGame
+
+#Requests start with a command and a number of games, a STEP request is
+#followed by one int8 action per game (1 = up, 0 = down, anything else
+#stays still). Every RESET and STEP is answered with the number of games
+#and then, for all of them, float32 observations (6 per game, in the order
+#of Game.observe), float32 rewards and uint8 done flags.
+RESET = 0
+STEP = 1
+CLOSE = 2
+
+HEADER = struct.Struct('<BI')
+COUNT = struct.Struct('<I')
+
+#Reads exactly size bytes, or returns None if the other side went away
+def receive(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    while size > 0:
+        received = sock.recv_into(view, size)
+        if received == 0:
+            return None
+        view = view[received:]
+        size -= received
+    return data
+
+class GameServer():
+    #Plays a BatchGame for whoever connects to the Unix socket at path,
+    #one client at a time. Finished games are started again straight away,
+    #the step that finished them is the one reported as done.
+
+    def __init__(self, path, games, speed=1):
+        self.path = path
+        self.games = BatchGame(games, speed=speed)
+        self.observation = np.zeros((games, 6), dtype=np.float32)
+        self.reward = np.zeros(games, dtype=np.float32)
+        self.finished = np.zeros(games, dtype=np.uint8)
+
+    def score(self):
+        return self.games.hits + self.games.wins - self.games.losses
+
+    def observe(self):
+        games = self.games
+        end_x, end_y = games.getEnd()
+        centerx, centery = games.ballCenter()
+        observation = self.observation
+        observation[:, 0] = games.userCenter()
+        observation[:, 1] = centerx
+        observation[:, 2] = centery
+        observation[:, 3] = end_x
+        observation[:, 4] = end_y
+        observation[:, 5] = self.score()
+        return observation
+
+    def reply(self, conn):
+        conn.sendall(b''.join((COUNT.pack(self.games.n), self.observe().tobytes(),
+                               self.reward.tobytes(), self.finished.tobytes())))
+
+    #Answers one client until it sends CLOSE (returns False) or goes away
+    #(returns True)
+    def handle(self, conn):
+        while True:
+            header = receive(conn, HEADER.size)
+            if header is None:
+                return True
+            command, n = HEADER.unpack(header)
+            if command == CLOSE:
+                return False
+            if command == RESET:
+                self.games.reset()
+                self.reward[:] = 0
+                self.finished[:] = 0
+            elif command == STEP:
+                actions = receive(conn, n)
+                if actions is None:
+                    return True
+                score = self.score()
+                self.games.step(np.frombuffer(actions, dtype=np.int8))
+                done = self.games.done()
+                self.reward[:] = self.score() - score
+                self.finished[:] = done
+                self.games.reset(done)
+            self.reply(conn)
+
+    def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(1)
+        try:
+            running = True
+            while running:
+                conn, address = listener.accept()
+                running = self.handle(conn)
+                conn.close()
+        finally:
+            listener.close()
+            os.unlink(self.path)
+
+def serve(path, games, speed=1):
+    GameServer(path, games, speed).serve()
+
+#Starts count server processes with the given number of games each and
+#returns the processes and their socket paths. The sockets go in directory,
+#or in a new temporary one that is left for the caller to remove.
+def startServers(count, games, speed=1, directory=None):
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='pong-')
+    paths = [os.path.join(directory, 'server-%d.sock' % i) for i in range(count)]
+    processes = []
+    for path in paths:
+        process = multiprocessing.Process(target=serve, args=(path, games, speed), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes, paths
+
+class GameClient():
+    #Talks to any number of servers as if they were one batch of games.
+    #Each request is sent to every server before any answer is read, so
+    #the servers step their games at the same time.
+
+    def __init__(self, paths, timeout=10.0):
+        self.sockets = []
+        for path in paths:
+            self.sockets.append(self.connect(path, timeout))
+        self.sizes = []
+        observation, reward, done = self.reset()
+        self.n = len(observation)
+
+    #Waits for a server that is still starting up
+    def connect(self, path, timeout):
+        start = time.time()
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.time() - start > timeout:
+                    raise
+                time.sleep(0.01)
+
+    def receiveReplies(self):
+        observations, rewards, dones, sizes = [], [], [], []
+        for sock in self.sockets:
+            count = receive(sock, COUNT.size)
+            if count is None:
+                raise ConnectionError('server closed the connection')
+            n, = COUNT.unpack(count)
+            data = receive(sock, n*6*4 + n*4 + n)
+            if data is None:
+                raise ConnectionError('server closed the connection')
+            observations.append(np.frombuffer(data, dtype=np.float32, count=n*6).reshape(n, 6))
+            rewards.append(np.frombuffer(data, dtype=np.float32, count=n, offset=n*6*4))
+            dones.append(np.frombuffer(data, dtype=np.uint8, count=n, offset=n*6*4 + n*4))
+            sizes.append(n)
+        self.sizes = sizes
+        return (np.concatenate(observations), np.concatenate(rewards),
+                np.concatenate(dones).astype(bool))
+
+    #Starts every game again, returns (observations, rewards, dones)
+    def reset(self):
+        for sock in self.sockets:
+            sock.sendall(HEADER.pack(RESET, 0))
+        return self.receiveReplies()
+
+    #Plays one frame of every game with one action each
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int8)
+        start = 0
+        for sock, n in zip(self.sockets, self.sizes):
+            sock.sendall(HEADER.pack(STEP, n) + actions[start:start+n].tobytes())
+            start += n
+        return self.receiveReplies()
+
+    #Disconnects, and stops the servers too unless stop_servers is False
+    def close(self, stop_servers=True):
+        for sock in self.sockets:
+            if stop_servers:
+                sock.sendall(HEADER.pack(CLOSE, 0))
+            sock.close()
+        self.sockets = []
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs games for a trainer in another '
+                                     'process, over a Unix socket.')
+    parser.add_argument('socket', help='path of the socket to listen on')
+    parser.add_argument('--games', type=int, default=64, help='games played side by side')
+    parser.add_argument('--speed', type=int, default=1)
+    args = parser.parse_args()
+    serve(args.socket, args.games, args.speed)
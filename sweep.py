@@ -0,0 +1,136 @@
+import argparse, ast, concurrent.futures, csv, itertools, multiprocessing, os, random, time
+
+#Each job imports network (and so keras) in its own process
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import evaluate
+
+#Turns ['learning_rate=0.01,0.1', 'epochs=10,50'] into a dict of the
+#values to try for each setting
+def readSpace(args):
+    space = {}
+    for arg in args:
+        name, values = arg.split('=', 1)
+        space[name] = [ast.literal_eval(value) for value in values.split(',')]
+    return space
+
+#Every combination of the values, or count of them picked at random
+def configurations(space, count=None, seed=0):
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+    if count is not None and count < len(grid):
+        grid = random.Random(seed).sample(grid, count)
+    return grid
+
+#Hits per lost point of the current policy over a few matches with random
+#moves mixed in, so they end. The matches are played at the speed the
+#policy is trained at.
+def score(policy, matches, noise, max_frames, speed=1):
+    evaluate.startWorker(policy.getWeights())
+    results = [evaluate.playMatch((seed, speed, 1, noise, max_frames)) for seed in range(matches)]
+    hits = sum(r['hits'] for r in results)
+    losses = sum(r['losses'] for r in results)
+    return hits / losses if losses > 0 else float(hits)
+
+#Trains one configuration headless in a fresh process. Every eval_every
+#games the policy is scored, and training stops once the score has not
+#improved for patience scorings in a row.
+def runJob(job):
+    index, settings, options = job
+    import network
+
+    config = {'headless': True}
+    config.update(settings)
+    network.configure(config)
+    planned = network.total_games
+
+    history = []
+    best = [None, 0]
+
+    class SweepWrapper(network.Wrapper):
+        def gameover(self, game_score):
+            network.Wrapper.gameover(self, game_score)
+            if network.num_games % options['eval_every'] != 0:
+                return
+            value = score(network.policy, options['eval_matches'], options['noise'],
+                          options['max_frames'], network.gameSpeed())
+            history.append(value)
+            if best[0] is None or value > best[0] + options['min_delta']:
+                best[0] = value
+                best[1] = 0
+            else:
+                best[1] += 1
+                if best[1] >= options['patience']:
+                    network.total_games = network.num_games
+
+    start = time.perf_counter()
+    error = ''
+    try:
+        SweepWrapper()
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+
+    row = {'job': index}
+    row.update(settings)
+    row.update({'games': network.num_games,
+                'best_hits_per_lost_point': best[0],
+                'final_hits_per_lost_point': history[-1] if len(history) > 0 else None,
+                'stopped_early': error == '' and network.num_games < planned,
+                'seconds': round(time.perf_counter() - start, 2),
+                'error': error})
+    return row
+
+def sweep(space, options, workers, count=None, seed=0, output='sweep.csv'):
+    jobs = [(i, settings, options) for i, settings in enumerate(configurations(space, count, seed))]
+    print('%d configurations on %d workers' % (len(jobs), workers))
+    #A new process for every job, so no job sees another one's model. Unlike
+    #a multiprocessing.Pool's, these workers are not daemons and a job can
+    #start processes of its own (collect_workers, servers).
+    executor = concurrent.futures.ProcessPoolExecutor(workers, max_tasks_per_child=1)
+    futures = [executor.submit(runJob, job) for job in jobs]
+    rows = []
+    for future in concurrent.futures.as_completed(futures):
+        row = future.result()
+        rows.append(row)
+        print(', '.join('%s=%s' % item for item in row.items()))
+    executor.shutdown()
+
+    rows.sort(key=lambda row: -1 if row['best_hits_per_lost_point'] is None
+              else row['best_hits_per_lost_point'], reverse=True)
+    f = open(output, 'w', newline='')
+    writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+    f.close()
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trains network.py with every combination '
+                                     'of the given settings and writes a table of the results.',
+                                     epilog='example: sweep.py learning_rate=0.01,0.1 '
+                                     'epochs=10,50 total_games=200')
+    parser.add_argument('space', nargs='+',
+                        help='name=value,value,... for any setting in network.CONFIGURABLE')
+    parser.add_argument('--random', type=int, metavar='N',
+                        help='try N combinations picked at random instead of all of them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--eval-every', type=int, default=10,
+                        help='games between scorings of the policy')
+    parser.add_argument('--eval-matches', type=int, default=4,
+                        help='matches each scoring plays')
+    parser.add_argument('--noise', type=float, default=0.1,
+                        help='chance of a random move in the scoring matches')
+    parser.add_argument('--max-frames', type=int, default=100000,
+                        help='frames after which a scoring match is called off')
+    parser.add_argument('--patience', type=int, default=3,
+                        help='scorings without improvement before a job stops')
+    parser.add_argument('--min-delta', type=float, default=0.0,
+                        help='how much better a scoring has to be to count')
+    parser.add_argument('--output', default='sweep.csv', help='results table')
+    args = parser.parse_args()
+
+    options = {'eval_every': args.eval_every, 'eval_matches': args.eval_matches,
+               'noise': args.noise, 'max_frames': args.max_frames,
+               'patience': args.patience, 'min_delta': args.min_delta}
+    sweep(readSpace(args.space), options, args.workers, args.random, args.seed, args.output)